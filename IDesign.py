@@ -1,20 +1,69 @@
-from autogen import GroupChatManager
+import functools
+import inspect
 import json
+import multiprocessing
+import os
 import re
-import networkx as nx
-
-from agents import create_agents
-from agents import is_termination_msg, gpt4_config
-from corrector_agents import get_corrector_agents
-from refiner_agents import get_refiner_agents
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from copy import deepcopy
 
-from chats import GroupChat, ChatWithEngineer, LayoutCorrectorGroupChat, ObjectDeletionGroupChat, LayoutRefinerGroupChat 
+import networkx as nx
+import numpy as np
 
-from utils import get_room_priors, extract_list_from_json
-from utils import preprocess_scene_graph, build_graph, remove_unnecessary_edges, handle_under_prepositions, get_conflicts, get_size_conflicts, get_object_from_scene_graph
+from utils import get_room_priors, extract_list_from_json, get_block_object_ids, remap_block_object_ids
+from utils import preprocess_scene_graph, build_graph, remove_unnecessary_edges, handle_under_prepositions
 from utils import get_object_from_scene_graph, get_rotation, get_cluster_objects, clean_and_extract_edges
-from utils import get_cluster_size
-from utils import get_possible_positions, is_point_bbox, calculate_overlap, get_topological_ordering, place_object, get_depth, get_visualization
+from utils import get_cluster_sizes
+from utils import get_possible_positions, is_point_bbox, calculate_overlap, place_object, get_depth, get_visualization
+from utils import get_backjump
+from collision import CollisionEngine
+from scene import CompiledScene, SceneGraph
+from conflicts import ConflictTracker
+from schemas import repair_initial, repair_corrected, repair_refined
+from metrics import Metrics, in_current_context, measure_stage
+from prompts import compact_conflict, compact_refiner_constraints, compact_size_conflicts, get_mentioned_object_ids
+
+def _load_agent_pool():
+    # The agent modules (and autogen) are imported in the LLM stages, so that only running the placement, ex. in the worker
+    # processes, doesn't load them
+    import agent_pool
+    return agent_pool
+
+def _with_pooled_agents(role, *attributes):
+    """
+    Decorator for the methods running one chat with an agents argument: if it isn't given, a set of agents of the role
+    (built with the given attributes of the design) is taken from the pool for the call. Given agents are reset first
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            agent_pool = _load_agent_pool()
+            bound = signature.bind(self, *args, **kwargs)
+            if bound.arguments.get("agents") is not None:
+                agent_pool.reset_agents(bound.arguments["agents"])
+                return function(*bound.args, **bound.kwargs)
+            with agent_pool.get_agent_pool().agents(role, *[getattr(self, attribute) for attribute in attributes]) as agents:
+                bound.arguments["agents"] = agents
+                return function(*bound.args, **bound.kwargs)
+        return wrapper
+    return decorator
+
+# Set in the worker processes of backtrack_with_restarts to cancel the searches that are no longer needed
+_stop_event = None
+_stop_events = None
+
+def _init_restart_worker(stop_events):
+    global _stop_events
+    _stop_events = stop_events
+
+def _run_restart(i_design, i, seed, kwargs):
+    # The search of the i-th seed stops on its own event
+    global _stop_event
+    _stop_event = _stop_events[i]
+    unplaced_objects = i_design.backtrack(seed=seed, **kwargs)
+    return i_design.scene_graph, unplaced_objects, seed
 
 class IDesign:
     def __init__(self, no_of_objects, user_input, room_dimensions):
@@ -23,26 +72,45 @@ class IDesign:
         self.room_dimensions = room_dimensions
         self.room_priors = get_room_priors(self.room_dimensions)
         self.scene_graph = None
+        self.unplaced_objects = None
+        self.seed = None
+        self.metrics = Metrics()
+
+    @_with_pooled_agents("initial", "no_of_objects")
+    def design_block(self, prompt, object_ids, new_object_ids=None, agents=None):
+        # Run the engineer on one designer/architect block and return its JSON, with agents from the pool if they aren't given
+        ids_prompt = "" if new_object_ids is None else f"""
+                Ids to use for the objects to be placed (in triple backquotes):
+                ```
+                {new_object_ids}
+                ```"""
 
-    def create_initial_design(self):
-        user_proxy, json_schema_debugger, interior_designer, interior_architect, engineer = create_agents(self.no_of_objects)
-        
-        groupchat = GroupChat(
-            agents=[user_proxy, interior_designer, interior_architect],
-            messages=[],
-            max_round=3
-        )
-
-        chat_with_engineer = ChatWithEngineer(
-            agents  =[user_proxy, engineer, json_schema_debugger],
-            messages=[],
-            max_round=15
+        agents.user_proxy.initiate_chat(
+            agents.engineer_manager,
+            # The indentation is part of the prompt, it is kept as it was for the cached responses
+            message=f"""
+                Room layout elements in the room (in triple backquotes):
+                ```
+                ['south_wall', 'north_wall', 'west_wall', 'east_wall', 'middle of the floor', 'ceiling']
+                ```
+                Array of objects in the room (in triple backquotes):
+                ```
+                {object_ids}
+                ```
+                Objects to be placed in the room (in triple backquotes):
+                ```
+                {prompt}
+                ```{ids_prompt}
+                json
+                """,
         )
+        return repair_initial(json.loads(agents.chat_with_engineer.messages[-2]["content"]))
 
-        manager = GroupChatManager(groupchat=groupchat, llm_config=gpt4_config, is_termination_msg=is_termination_msg)
-        user_proxy.initiate_chat(
-            manager,
-            message=f"""
+    @measure_stage
+    def create_initial_design(self, concurrent=False, max_workers=4, compact_prompts=False):
+        # With concurrent, the engineer chats of the blocks run in parallel (at most max_workers at once).
+        # With compact_prompts, the engineer only gets the ids of the objects mentioned in the block instead of all of them
+        message = f"""
             The room has the size {self.room_dimensions[0]}m x {self.room_dimensions[1]}m x {self.room_dimensions[2]}m
             User Preference (in triple backquotes):
             ```
@@ -53,11 +121,11 @@ class IDesign:
             ['south_wall', 'north_wall', 'west_wall', 'east_wall', 'middle of the room', 'ceiling']
             ```
             json
-            """,
-        )
-
-        designer_response = json.loads(groupchat.messages[-2]["content"])
-        architect_response = json.loads(groupchat.messages[-1]["content"])
+            """
+        with _load_agent_pool().get_agent_pool().agents("initial", self.no_of_objects) as agents:
+            agents.user_proxy.initiate_chat(agents.manager, message=message)
+            designer_response = json.loads(agents.groupchat.messages[-2]["content"])
+            architect_response = json.loads(agents.groupchat.messages[-1]["content"])
 
         blocks_designer, blocks_architect = extract_list_from_json(designer_response), extract_list_from_json(architect_response)
         if len(blocks_designer) != len(blocks_architect):
@@ -66,49 +134,84 @@ class IDesign:
         
         json_data = None
 
-        for d_block, a_block in zip(blocks_designer, blocks_architect):
-            engineer.reset(), json_schema_debugger.reset()
-            prompt = str(d_block) + "\n" + str(a_block)
-
-            object_ids = [item["new_object_id"] for item in json_data["objects_in_room"]] if json_data is not None else []
-
-            manager = GroupChatManager(groupchat=chat_with_engineer, 
-                                       llm_config=gpt4_config, 
-                                       human_input_mode="NEVER", 
-                                       is_termination_msg=is_termination_msg)
-            user_proxy.initiate_chat(
-                manager,
-                message=f"""
-                Room layout elements in the room (in triple backquotes):
-                ```
-                ['south_wall', 'north_wall', 'west_wall', 'east_wall', 'middle of the floor', 'ceiling']
-                ```
-                Array of objects in the room (in triple backquotes):
-                ```
-                {object_ids}
-                ```
-                Objects to be placed in the room (in triple backquotes):
-                ```
-                {prompt}
-                ```
-                json
-                """,
-            )
-            if json_data is None:
-                json_data = json.loads(chat_with_engineer.messages[-2]["content"])
-            else:
-                json_data["objects_in_room"] += json.loads(chat_with_engineer.messages[-2]["content"])["objects_in_room"]
+        if concurrent:
+            # The ids are assigned up front, so that every block only needs the ids of the blocks before it
+            counters = {}
+            block_ids = [get_block_object_ids(d_block, counters) for d_block in blocks_designer]
+            inputs = [(str(d_block) + "\n" + str(a_block), sum(block_ids[:i], []), block_ids[i]) for i, (d_block, a_block) in enumerate(zip(blocks_designer, blocks_architect))]
+            if compact_prompts:
+                inputs = [(prompt, get_mentioned_object_ids(prompt, object_ids), new_object_ids) for prompt, object_ids, new_object_ids in inputs]
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                responses = list(executor.map(in_current_context(lambda x : self.design_block(*x)), inputs))
+            # Merged in the order of the blocks, with the ids assigned to them
+            for response, new_object_ids in zip(responses, block_ids):
+                renamed = remap_block_object_ids(response["objects_in_room"], new_object_ids, counters)
+                if renamed:
+                    print("Renamed objects: ", renamed)
+                if json_data is None:
+                    json_data = response
+                else:
+                    json_data["objects_in_room"] += response["objects_in_room"]
+        else:
+            for d_block, a_block in zip(blocks_designer, blocks_architect):
+                prompt = str(d_block) + "\n" + str(a_block)
+                object_ids = [item["new_object_id"] for item in json_data["objects_in_room"]] if json_data is not None else []
+                if compact_prompts:
+                    object_ids = get_mentioned_object_ids(prompt, object_ids)
+                response = self.design_block(prompt, object_ids)
+                if json_data is None:
+                    json_data = response
+                else:
+                    json_data["objects_in_room"] += response["objects_in_room"]
             
+        json_data["objects_in_room"] = SceneGraph(json_data["objects_in_room"])
         self.scene_graph = json_data
 
-    def correct_design(self, verbose=False, auto_prune=True):
+    @_with_pooled_agents("corrector")
+    def correct_conflict(self, conflict, agents=None):
+        # Run the spatial corrector on one conflict and return the corrected object, with agents from the pool if they aren't given
+        agents.user_proxy.initiate_chat(
+            agents.manager,
+            message=f"""
+            {conflict}
+            """,
+        )
+        correction = agents.groupchat.messages[-2]
+        pattern = r'```json\s*([^`]+)\s*```' # Match the json object
+        match = re.search(pattern, correction["content"], re.DOTALL).group(1)
+        correction_json = repair_corrected(json.loads(match))
+        return correction_json["corrected_object"]
+
+    @_with_pooled_agents("corrector")
+    def delete_object(self, size_conflict, agents=None):
+        # Ask the object deletion agent which object to delete for one size conflict, with agents from the pool if they aren't given
+        agents.user_proxy.initiate_chat(
+            agents.deletion_manager,
+            message=f"""
+            {size_conflict}
+            """,
+        )
+        correction = agents.deletion_groupchat.messages[-1]
+        correction_json = json.loads(correction["content"])
+        return correction_json["object_to_delete"]
+
+    @measure_stage
+    def correct_design(self, verbose=False, auto_prune=True, batch_conflicts=False, max_workers=4, compact_prompts=False, token_budget=None):
+        # With batch_conflicts, the conflicts on disjoint parts of the graph are corrected in parallel chats
+        # (at most max_workers at once) and merged before checking again, instead of one conflict per chat.
+        # With compact_prompts, the conflicts are sent deduplicated with only the keys of the object the corrector needs, and
+        # the size conflicts between the same objects are merged into one prompt. token_budget (in tokens) lets the prompts
+        # of the corrector grow up to it with the constraints of the subgraph around the object
         # Correct Spatial Conflicts
-        scene_graph = preprocess_scene_graph(self.scene_graph["objects_in_room"])
+        scene_graph = preprocess_scene_graph(SceneGraph(self.scene_graph["objects_in_room"]))
         G = build_graph(scene_graph)
         G = remove_unnecessary_edges(G)
         G, scene_graph = handle_under_prepositions(G, scene_graph)
+        scene_graph = SceneGraph(scene_graph)
 
-        conflicts = get_conflicts(G, scene_graph)
+        # Only the conflicts around the corrected or deleted objects are checked again
+        tracker = ConflictTracker(G, scene_graph, self.user_input, self.room_priors, verbose)
+        conflicts = tracker.get_conflicts()
 
         if verbose:
             print("-------------------CONFLICTS-------------------")
@@ -116,35 +219,26 @@ class IDesign:
                 print(conflict)
                 print("\n\n")
 
-        user_proxy, spatial_corrector_agent, json_schema_debugger, object_deletion_agent = get_corrector_agents()
-
         while len(conflicts) > 0:
-            spatial_corrector_agent.reset(), json_schema_debugger.reset()
-            groupchat = LayoutCorrectorGroupChat(
-                agents  =[user_proxy, spatial_corrector_agent, json_schema_debugger],
-                messages=[],
-                max_round=15
-            )
-            manager = GroupChatManager(groupchat=groupchat, llm_config=gpt4_config, is_termination_msg=is_termination_msg)
-            user_proxy.initiate_chat(
-                manager,
-                message=f"""
-                {conflicts[0]}
-                """,
-            )
-            correction = groupchat.messages[-2]
-            pattern = r'```json\s*([^`]+)\s*```' # Match the json object
-            match = re.search(pattern, correction["content"], re.DOTALL).group(1)
-            correction_json = json.loads(match)
-            corr_obj = get_object_from_scene_graph(correction_json["corrected_object"]["new_object_id"], scene_graph)
-            corr_obj["is_on_the_floor"] = correction_json["corrected_object"]["is_on_the_floor"]
-            corr_obj["facing"] = correction_json["corrected_object"]["facing"]
-            corr_obj["placement"] = correction_json["corrected_object"]["placement"]
-            G = build_graph(scene_graph)
-            conflicts = get_conflicts(G, scene_graph)
+            if batch_conflicts:
+                batch = tracker.get_independent_conflicts()
+                if compact_prompts:
+                    batch = [compact_conflict(conflict, tracker.G, token_budget) for conflict in batch]
+                with ThreadPoolExecutor(max_workers=min(max_workers, len(batch))) as executor:
+                    corrections = list(executor.map(in_current_context(self.correct_conflict), batch))
+            else:
+                corrections = [self.correct_conflict(compact_conflict(conflicts[0], tracker.G, token_budget) if compact_prompts else conflicts[0])]
+            # Applied in the order of the conflicts
+            for corrected_object in corrections:
+                corr_obj = get_object_from_scene_graph(corrected_object["new_object_id"], tracker.scene_graph)
+                corr_obj["is_on_the_floor"] = corrected_object["is_on_the_floor"]
+                corr_obj["facing"] = corrected_object["facing"]
+                corr_obj["placement"] = corrected_object["placement"]
+                tracker.update(corr_obj["new_object_id"])
+            conflicts = tracker.get_conflicts()
 
         if auto_prune:
-            size_conflicts = get_size_conflicts(G, scene_graph, self.user_input, self.room_priors, verbose)
+            size_conflicts = tracker.get_size_conflicts()
 
             if verbose:
                 print("-------------------SIZE CONFLICTS-------------------")
@@ -153,33 +247,72 @@ class IDesign:
                     print("\n\n")
 
             while len(size_conflicts) > 0:
-                object_deletion_agent.reset()
-                groupchat = ObjectDeletionGroupChat(
-                    agents  =[user_proxy, object_deletion_agent],
-                    messages=[],
-                    max_round=2
-                )
-                manager = GroupChatManager(groupchat=groupchat, llm_config=gpt4_config, is_termination_msg=is_termination_msg)
-                user_proxy.initiate_chat(
-                    manager,
-                    message=f"""
-                    {size_conflicts[0]}
-                    """,
-                )
-                correction = groupchat.messages[-1]
-                correction_json = json.loads(correction["content"])
-                object_to_delete = correction_json["object_to_delete"]
-                descendants = nx.descendants(G, object_to_delete)
+                object_to_delete = self.delete_object(compact_size_conflicts(size_conflicts, token_budget)[0] if compact_prompts else size_conflicts[0])
+                descendants = nx.descendants(tracker.G, object_to_delete)
                 objs_to_delete = descendants.union({object_to_delete})
                 print("Objs to Delete: ", objs_to_delete)
-                scene_graph = [x for x in scene_graph if x["new_object_id"] not in objs_to_delete]
-                for obj in objs_to_delete:
-                    G.remove_node(obj)
+                tracker.remove(objs_to_delete)
+
+                size_conflicts = tracker.get_size_conflicts()
+        self.scene_graph["objects_in_room"] = tracker.scene_graph
+
+    @_with_pooled_agents("refiner")
+    def refine_cluster(self, parent_id, prep, obj_names, agents=None, verbose=False, compact_prompts=False):
+        # Run the layout refiner on one cluster and return the valid new relationships between its children, None if there aren't any.
+        # Uses agents from the pool if they aren't given
+        objs = [get_object_from_scene_graph(obj, self.scene_graph["objects_in_room"]) for obj in obj_names]
+        objs_rot = [get_rotation(obj, self.scene_graph["objects_in_room"]) for obj in objs]
+
+        parent_obj = get_object_from_scene_graph(parent_id, self.scene_graph["objects_in_room"])
+        if parent_obj is None:
+            parent_obj = [prior for prior in self.room_priors if prior.get("new_object_id") == parent_id][0]
+        parent_obj_rot = get_rotation(parent_obj, self.scene_graph["objects_in_room"])
+
+        rot_diffs = [obj_rot - parent_obj_rot for obj_rot in objs_rot]
+        direction_check = lambda diff, prep: (diff % 180 == 0 and prep in ["left of", "right of"]) or (diff % 180 != 0 and prep in ["in front", "behind"]) or (diff % 180 != 0 and prep == "on")
+        possibilities_str = "Constraints:\n" + '\n'.join(["\t" + f"Place objects {'`behind` or `in front`' if direction_check(diff, prep) else '`left of` or `right of`'} of {name}!" for name, diff in zip(obj_names, rot_diffs)])
+        message = f"""
+                Parent Object : {parent_id}
+                Children Objects : {obj_names}
+
+                {possibilities_str}
 
-                size_conflicts = get_size_conflicts(G, scene_graph, self.user_input, self.room_priors, verbose)
-        self.scene_graph["objects_in_room"] = scene_graph
+                The children objects are '{prep}' the parent object
+                """
+        if compact_prompts:
+            # Without the indentation, and the children with the same constraint in one line
+            possibilities_str = compact_refiner_constraints(obj_names, [direction_check(diff, prep) for diff in rot_diffs])
+            message = f"Parent Object : {parent_id}\nChildren Objects : {obj_names}\n{possibilities_str}\nThe children objects are '{prep}' the parent object"
+
+        agents.user_proxy.initiate_chat(
+            agents.manager,
+            message=message,
+        )
 
-    def refine_design(self, verbose=False):
+        new_relationships = repair_refined(json.loads(agents.groupchat.messages[-2]["content"]))
+        # Check whether the relationships are valid
+        invalid_name_ids = []
+        for child in new_relationships["children_objects"]:
+            for other_child in child["placement"]["children_objects"]:
+                other_child_rot = get_rotation(get_object_from_scene_graph(other_child["name_id"], self.scene_graph["objects_in_room"]), self.scene_graph["objects_in_room"])
+                if direction_check(other_child_rot - parent_obj_rot, prep) and other_child["preposition"] not in ["in front", "behind"]:
+                    invalid_name_ids.append(child["name_id"])
+                elif not direction_check(other_child_rot - parent_obj_rot, prep) and other_child["preposition"] not in ["left of", "right of"]:
+                    invalid_name_ids.append(child["name_id"])
+
+        if verbose:
+            print("Invalid name IDs: ", invalid_name_ids)
+        new_relationships["children_objects"] = [child for child in new_relationships["children_objects"] if child["name_id"] not in invalid_name_ids]         
+        
+        if len(new_relationships["children_objects"]) == 0:
+            return None
+        return new_relationships
+
+    @measure_stage
+    def refine_design(self, verbose=False, max_workers=4, compact_prompts=False):
+        # The clusters are refined in parallel chats (at most max_workers at once, with agents from the pool),
+        # the new edges are added afterwards in the order of the clusters. compact_prompts shortens the prompts of the refiner
+        self.scene_graph["objects_in_room"] = SceneGraph(self.scene_graph["objects_in_room"])
         cluster_dict = get_cluster_objects(self.scene_graph["objects_in_room"])
 
         inputs = []
@@ -204,71 +337,22 @@ class IDesign:
                 print(f"The children objects are '{prep}' the parent object")
                 print("\n")
 
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(in_current_context(lambda cluster : self.refine_cluster(*cluster, verbose=verbose, compact_prompts=compact_prompts)), inputs))
 
-        for parent_id, prep, obj_names in inputs:
-            objs = [get_object_from_scene_graph(obj, self.scene_graph["objects_in_room"]) for obj in obj_names]
-            objs_rot = [get_rotation(obj, self.scene_graph["objects_in_room"]) for obj in objs]
-
-            parent_obj = get_object_from_scene_graph(parent_id, self.scene_graph["objects_in_room"])
-            if parent_obj is None:
-                parent_obj = [prior for prior in self.room_priors if prior.get("new_object_id") == parent_id][0]
-            parent_obj_rot = get_rotation(parent_obj, self.scene_graph["objects_in_room"])
-
-            rot_diffs = [obj_rot - parent_obj_rot for obj_rot in objs_rot]
-            direction_check = lambda diff, prep: (diff % 180 == 0 and prep in ["left of", "right of"]) or (diff % 180 != 0 and prep in ["in front", "behind"]) or (diff % 180 != 0 and prep == "on")
-            possibilities_str = "Constraints:\n" + '\n'.join(["\t" + f"Place objects {'`behind` or `in front`' if direction_check(diff, prep) else '`left of` or `right of`'} of {name}!" for name, diff in zip(obj_names, rot_diffs)])
-
-            user_proxy, layout_refiner, json_schema_debugger = get_refiner_agents()
-
-            layout_refiner.reset(), json_schema_debugger.reset()
-            groupchat = LayoutRefinerGroupChat(
-                agents  =[user_proxy, layout_refiner, json_schema_debugger],
-                messages=[],
-                max_round=15
-            )
-            manager = GroupChatManager(groupchat=groupchat, llm_config=gpt4_config, is_termination_msg=is_termination_msg)
-            user_proxy.initiate_chat(
-                manager,
-                message=f"""
-                Parent Object : {parent_id}
-                Children Objects : {obj_names}
-
-                {possibilities_str}
+        prep_correspondences ={
+            "left of" : "right of",
+            "right of" : "left of",
+            "in front" : "behind",
+            "behind" : "in front",
+        }
 
-                The children objects are '{prep}' the parent object
-                """,
-            )
-
-            new_relationships = json.loads(groupchat.messages[-2]["content"])
-            if "items" in new_relationships["children_objects"]:
-                new_relationships = {"children_objects" : new_relationships["children_objects"]["items"]}
-            # Check whether the relationships are valid
-            invalid_name_ids = []
-            for child in new_relationships["children_objects"]:
-                for other_child in child["placement"]["children_objects"]:
-                    other_child_rot = get_rotation(get_object_from_scene_graph(other_child["name_id"], self.scene_graph["objects_in_room"]), self.scene_graph["objects_in_room"])
-                    if direction_check(other_child_rot - parent_obj_rot, prep) and other_child["preposition"] not in ["in front", "behind"]:
-                        invalid_name_ids.append(child["name_id"])
-                    elif not direction_check(other_child_rot - parent_obj_rot, prep) and other_child["preposition"] not in ["left of", "right of"]:
-                        invalid_name_ids.append(child["name_id"])
-
-            if verbose:
-                print("Invalid name IDs: ", invalid_name_ids)
-            new_relationships["children_objects"] = [child for child in new_relationships["children_objects"] if child["name_id"] not in invalid_name_ids]         
-            
-            if len(new_relationships["children_objects"]) == 0:
+        for (parent_id, prep, obj_names), new_relationships in zip(inputs, results):
+            if new_relationships is None:
                 continue
 
             edges, edges_to_flip = clean_and_extract_edges(new_relationships, parent_id, verbose=verbose)
 
-            prep_correspondences ={
-                "left of" : "right of",
-                "right of" : "left of",
-                "in front" : "behind",
-                "behind" : "in front",
-            }
-
-
             for obj in new_relationships["children_objects"]:
                 name_id = obj["name_id"]
                 rel = obj["placement"]["children_objects"]
@@ -279,11 +363,15 @@ class IDesign:
                             corr_obj = get_object_from_scene_graph(r["name_id"], self.scene_graph["objects_in_room"])
                             corr_prep = prep_correspondences[r["preposition"]]
                             corr_obj["placement"]["objects_in_room"].append({"object_id" : name_id, "preposition" : corr_prep, "is_adjacent" : r["is_adjacent"]})
+                            self.scene_graph["objects_in_room"].invalidate(corr_obj["new_object_id"])
                         else:
                             corr_obj = get_object_from_scene_graph(name_id, self.scene_graph["objects_in_room"])
                             corr_obj["placement"]["objects_in_room"].append({"object_id" : r["name_id"], "preposition" : r["preposition"], "is_adjacent" : r["is_adjacent"]})
+                            self.scene_graph["objects_in_room"].invalidate(corr_obj["new_object_id"])
 
+    @measure_stage
     def create_object_clusters(self, verbose=False):
+        self.scene_graph["objects_in_room"] = SceneGraph(self.scene_graph["objects_in_room"])
         # Assign the rotations
         for obj in self.scene_graph["objects_in_room"]:
             rot = get_rotation(obj, self.scene_graph["objects_in_room"])
@@ -293,11 +381,12 @@ class IDesign:
 
         G = build_graph(self.scene_graph["objects_in_room"])
         nodes = G.nodes()
+        cluster_sizes = get_cluster_sizes(G, self.scene_graph["objects_in_room"])
 
         # Create clusters
         for node in nodes:
             if node not in ROOM_LAYOUT_ELEMENTS:
-                cluster_size, children_objs = get_cluster_size(node, G, self.scene_graph["objects_in_room"])
+                cluster_size, children_objs = cluster_sizes[node]
                 if verbose:
                     print("Node: ", node)
                     print("Cluster size: ", cluster_size)
@@ -307,8 +396,22 @@ class IDesign:
                 cluster_size = {"x_neg" : cluster_size["left of"], "x_pos" : cluster_size["right of"], "y_neg" : cluster_size["behind"], "y_pos" : cluster_size["in front"]}
                 node_obj["cluster"] = {"constraint_area" : cluster_size}
 
-    def backtrack(self, verbose=False):
-        self.scene_graph = self.scene_graph["objects_in_room"] + self.room_priors
+    @measure_stage
+    def backtrack(self, verbose=False, sampling="random", batch_size=16, backjumping=False, max_iterations=None, time_limit=None, restarts=1, seeds=None, seed=None):
+        # With max_iterations or time_limit (in seconds) set, the search stops when the budget runs out and keeps
+        # the layout with the most placed objects found so far. Returns the ids of the objects left unplaced.
+        # All the sampling is drawn from one generator seeded with seed, a random seed is picked if it isn't given
+        if restarts > 1 or seeds is not None:
+            seeds = seeds if seeds is not None else list(range(restarts))
+            kwargs = {"sampling" : sampling, "batch_size" : batch_size, "backjumping" : backjumping, "max_iterations" : max_iterations, "time_limit" : time_limit}
+            return self.backtrack_with_restarts(seeds, verbose=verbose, **kwargs)
+
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().generate_state(1)[0])
+        rng = np.random.default_rng(self.seed)
+        start_time = time.perf_counter()
+        deadline = start_time + time_limit if time_limit is not None else None
+        self.scene_graph = SceneGraph(self.scene_graph["objects_in_room"] + self.room_priors)
+        compiled_scene = CompiledScene(self.scene_graph)
         prior_ids = ["south_wall", "north_wall", "east_wall", "west_wall", "ceiling", "middle of the room"]
         
         point_bbox = dict.fromkeys([item["new_object_id"] for item in self.scene_graph], False)
@@ -317,7 +420,7 @@ class IDesign:
         for item in self.scene_graph:
             if item["new_object_id"] in prior_ids:
                 continue
-            possible_pos = get_possible_positions(item["new_object_id"], self.scene_graph, self.room_dimensions)
+            possible_pos = get_possible_positions(item["new_object_id"], self.scene_graph, self.room_dimensions, compiled_scene)
             # Determine the overlap based on the possible positions
             overlap = None
             if len(possible_pos) == 1:
@@ -332,7 +435,6 @@ class IDesign:
                 point_bbox[item["new_object_id"]] = True
         
         scene_graph_wo_layout = [item for item in self.scene_graph if item["new_object_id"] not in prior_ids]
-        object_ids = [item["new_object_id"] for item in scene_graph_wo_layout]
         # Get depths
         depth_scene_graph = get_depth(scene_graph_wo_layout)
         max_depth = max(depth_scene_graph.values())
@@ -346,13 +448,28 @@ class IDesign:
                 if "position" in obj.keys():
                     print(obj["new_object_id"], obj["position"])
         
-        topological_order = get_topological_ordering(scene_graph_wo_layout)
-        topological_order = [item for item in topological_order if item not in prior_ids]
+        topological_order = [compiled_scene.ids[i] for i in compiled_scene.order if compiled_scene.ids[i] not in prior_ids]
         if verbose:
             print("Topological order: ", topological_order)
+
+        collision_engine = CollisionEngine(self.scene_graph, self.room_dimensions)
+        best_positions = {}
         
         d = 1
+        iterations = 0
         while d <= max_depth:   
+            iterations += 1
+            if (max_iterations is not None and iterations > max_iterations) or (deadline is not None and time.perf_counter() > deadline) or (_stop_event is not None and _stop_event.is_set()):
+                if verbose:
+                    print(f"Search budget exhausted after {iterations - 1} iterations, keeping the best layout found")
+                # Restore the best partial layout
+                if len(best_positions) > len([item for item in scene_graph_wo_layout if "position" in item.keys()]):
+                    for item in scene_graph_wo_layout:
+                        if item["new_object_id"] in best_positions:
+                            collision_engine.place(item, deepcopy(best_positions[item["new_object_id"]]))
+                        else:
+                            collision_engine.unplace(item)
+                break
             if verbose:
                 print("Depth: ", d)
             error_flag = False
@@ -368,34 +485,95 @@ class IDesign:
                     continue
                 
                 # Find the object corresponding to the current node
-                obj = next(item for item in scene_graph_wo_layout if item["new_object_id"] == node)
-                errors = place_object(obj, self.scene_graph, self.room_dimensions, errors={}, verbose=verbose)
+                obj = compiled_scene.get(node)
+                errors = place_object(obj, self.scene_graph, self.room_dimensions, errors={}, verbose=verbose, collision_engine=collision_engine, sampling=sampling, batch_size=batch_size, deadline=deadline, stop_event=_stop_event, rng=rng, compiled_scene=compiled_scene)
                 if verbose:
                     print(f"Errors for {obj['new_object_id']}:", errors)
 
+                if not errors:
+                    positions = {item["new_object_id"] : item["position"] for item in scene_graph_wo_layout if "position" in item.keys()}
+                    if len(positions) > len(best_positions):
+                        best_positions = deepcopy(positions)
+
                 if errors:
+                    error_flag = True
+                    # Jump back to the deepest object causing the conflict that can still be moved
+                    culprits, jump_depth = get_backjump(errors, depth_scene_graph, d, fixed={k for k, v in point_bbox.items() if v}) if backjumping else ([], None)
+                    if culprits:
+                        d = jump_depth
+                        if verbose:
+                            print(f"Jumping to depth {d} because of: ", culprits)
+                        # Delete positions only for the conflicting objects and their descendants
+                        objs_to_reset = {node}.union(compiled_scene.get_descendants(node))
+                        for c in culprits:
+                            objs_to_reset = objs_to_reset.union({c}, compiled_scene.get_descendants(c))
+                        for del_item in scene_graph_wo_layout:
+                            if del_item["new_object_id"] in objs_to_reset and "position" in del_item.keys() and not point_bbox[del_item["new_object_id"]]:
+                                if verbose:
+                                    print("Deleting position for: ", del_item["new_object_id"])
+                                collision_engine.unplace(del_item)
+                        errors = {}
+                        break
+
                     if d > 1:
                         d -= 1
                         if verbose:
                             print("Reducing depth to: ", d)
                     
-                    error_flag = True
                     # Delete positions for objects at or beyond the current depth
                     for del_item in scene_graph_wo_layout:
                         if depth_scene_graph[del_item["new_object_id"]] >= d:
                             if "position" in del_item.keys() and not point_bbox[del_item["new_object_id"]]:
                                 if verbose:
                                     print("Deleting position for: ", del_item["new_object_id"])
-                                del del_item["position"]
+                                collision_engine.unplace(del_item)
                     errors = {}
                     break
                             
             if not error_flag:
                 d += 1
+
+        self.unplaced_objects = [item["new_object_id"] for item in scene_graph_wo_layout if "position" not in item.keys()]
         if verbose:
+            print("Unplaced objects: ", self.unplaced_objects)
             get_visualization(self.scene_graph, self.room_priors)
+        return self.unplaced_objects
     
+    def backtrack_with_restarts(self, seeds, verbose=False, **kwargs):
+        # Run independent seeded searches in a process pool. The result is the one of the first seed (in the order of
+        # seeds) with a full solution, else the one with the fewest unplaced objects, the earliest seed on a tie. It
+        # doesn't depend on which search finishes first: a full solution only stops the searches of the later seeds
+        stop_events = [multiprocessing.Event() for _ in seeds]
+        executor = ProcessPoolExecutor(max_workers=min(len(seeds), os.cpu_count() or 1), initializer=_init_restart_worker, initargs=(stop_events,))
+        futures = {executor.submit(_run_restart, self, i, seed, kwargs) : i for i, seed in enumerate(seeds)}
+        results = {}
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if verbose:
+                    print(f"Seed {seeds[i]}: {len(results[i][1])} unplaced objects")
+                if len(results[i][1]) == 0:
+                    for stop_event in stop_events[i + 1:]:
+                        stop_event.set()
+                # Done once the first full solution is known to be the first one
+                full = [j for j in results if len(results[j][1]) == 0]
+                if full and all(j in results for j in range(min(full))):
+                    break
+        finally:
+            for stop_event in stop_events:
+                stop_event.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+        full = [j for j in results if len(results[j][1]) == 0]
+        best = results[min(full)] if full else results[min(results, key=lambda i : (len(results[i][1]), i))]
+
+        self.scene_graph, self.unplaced_objects, self.seed = best
+        if verbose:
+            print("Unplaced objects: ", self.unplaced_objects)
+        return self.unplaced_objects
+
     def to_json(self, filename="scene_graph.json"):
-        # Save the scene graph to a json file
+        # Save the scene graph to a json file, along with the seed used for the placement
+        objects_in_room = self.scene_graph["objects_in_room"] if isinstance(self.scene_graph, dict) else self.scene_graph
         with open(filename, "w") as file:
-            json.dump(self.scene_graph, file, indent=4)
\ No newline at end of file
+            json.dump({"seed" : self.seed, "objects_in_room" : objects_in_room}, file, indent=4)
\ No newline at end of file
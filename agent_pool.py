@@ -0,0 +1,146 @@
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from autogen import GroupChatManager
+
+from agents import create_agents, get_manager_config, is_termination_msg
+from corrector_agents import get_corrector_agents
+from refiner_agents import get_refiner_agents
+from chats import GroupChat, ChatWithEngineer, LayoutCorrectorGroupChat, ObjectDeletionGroupChat, LayoutRefinerGroupChat
+
+def build_initial_agents(no_of_objects):
+    # The designer, architect and engineer, with their group chats and managers
+    user_proxy, json_schema_debugger, interior_designer, interior_architect, engineer = create_agents(no_of_objects)
+    groupchat = GroupChat(
+        agents=[user_proxy, interior_designer, interior_architect],
+        messages=[],
+        max_round=3
+    )
+    chat_with_engineer = ChatWithEngineer(
+        agents  =[user_proxy, engineer, json_schema_debugger],
+        messages=[],
+        max_round=15
+    )
+    return SimpleNamespace(
+        user_proxy=user_proxy,
+        json_schema_debugger=json_schema_debugger,
+        interior_designer=interior_designer,
+        interior_architect=interior_architect,
+        engineer=engineer,
+        groupchat=groupchat,
+        manager=GroupChatManager(groupchat=groupchat, llm_config=get_manager_config(), is_termination_msg=is_termination_msg),
+        chat_with_engineer=chat_with_engineer,
+        engineer_manager=GroupChatManager(groupchat=chat_with_engineer, llm_config=get_manager_config(), human_input_mode="NEVER", is_termination_msg=is_termination_msg),
+    )
+
+def build_corrector_agents():
+    # The spatial corrector and the object deletion agent, with their group chats and managers
+    user_proxy, spatial_corrector_agent, json_schema_debugger, object_deletion_agent = get_corrector_agents()
+    groupchat = LayoutCorrectorGroupChat(
+        agents  =[user_proxy, spatial_corrector_agent, json_schema_debugger],
+        messages=[],
+        max_round=15
+    )
+    deletion_groupchat = ObjectDeletionGroupChat(
+        agents  =[user_proxy, object_deletion_agent],
+        messages=[],
+        max_round=2
+    )
+    return SimpleNamespace(
+        user_proxy=user_proxy,
+        spatial_corrector_agent=spatial_corrector_agent,
+        json_schema_debugger=json_schema_debugger,
+        object_deletion_agent=object_deletion_agent,
+        groupchat=groupchat,
+        manager=GroupChatManager(groupchat=groupchat, llm_config=get_manager_config(), is_termination_msg=is_termination_msg),
+        deletion_groupchat=deletion_groupchat,
+        deletion_manager=GroupChatManager(groupchat=deletion_groupchat, llm_config=get_manager_config(), is_termination_msg=is_termination_msg),
+    )
+
+def build_refiner_agents():
+    # The layout refiner, with its group chat and manager
+    user_proxy, layout_refiner, json_schema_debugger = get_refiner_agents()
+    groupchat = LayoutRefinerGroupChat(
+        agents  =[user_proxy, layout_refiner, json_schema_debugger],
+        messages=[],
+        max_round=15
+    )
+    return SimpleNamespace(
+        user_proxy=user_proxy,
+        layout_refiner=layout_refiner,
+        json_schema_debugger=json_schema_debugger,
+        groupchat=groupchat,
+        manager=GroupChatManager(groupchat=groupchat, llm_config=get_manager_config(), is_termination_msg=is_termination_msg),
+    )
+
+def reset_agents(agents):
+    """
+    Clear the histories of the agents and the messages of the group chats, so that the next chat starts fresh
+    """
+    for value in vars(agents).values():
+        value.reset()
+
+class AgentPool:
+    """
+    Agents built once per role (and arguments) and reused between chats, instead of building new agents and managers
+    with their system messages for every chat. A set of agents is used by one chat at a time: acquire takes a free one,
+    built if there isn't any, and release resets it and puts it back, so the pool can be shared by concurrent sessions
+    """
+    builders = {
+        "initial" : build_initial_agents,
+        "corrector" : build_corrector_agents,
+        "refiner" : build_refiner_agents,
+    }
+
+    def __init__(self):
+        self.free = {}
+        self.built = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, role, *args):
+        with self.lock:
+            free = self.free.get((role, args))
+            if free:
+                return free.pop()
+            self.built += 1
+        # Built outside of the lock, the other sessions don't wait for it
+        return self.builders[role](*args)
+
+    def release(self, role, agents, *args):
+        reset_agents(agents)
+        with self.lock:
+            self.free.setdefault((role, args), []).append(agents)
+
+    @contextmanager
+    def agents(self, role, *args):
+        """
+        A set of agents of the role for the duration of the with block
+        """
+        agents = self.acquire(role, *args)
+        try:
+            yield agents
+        finally:
+            self.release(role, agents, *args)
+
+    def clear(self):
+        with self.lock:
+            self.free = {}
+
+_agent_pool = None
+_agent_pool_lock = threading.Lock()
+
+def get_agent_pool():
+    """
+    The pool shared by all the designs in the process
+    """
+    global _agent_pool
+    with _agent_pool_lock:
+        if _agent_pool is None:
+            _agent_pool = AgentPool()
+        return _agent_pool
+
+def set_agent_pool(agent_pool):
+    global _agent_pool
+    with _agent_pool_lock:
+        _agent_pool = agent_pool
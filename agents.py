@@ -3,49 +3,16 @@ from autogen.agentchat.agent import Agent
 from autogen.agentchat.user_proxy_agent import UserProxyAgent
 from autogen.agentchat.assistant_agent import AssistantAgent
 import json
-from jsonschema import validate
-from copy import deepcopy
 
 from schemas import initial_schema, interior_architect_schema, interior_designer_schema, engineer_schema
+from schemas import get_validator, get_validation_error, repair_initial
+from llm_cache import use_response_cache
+from llm_backend import get_llm_config
 
-config_list_gpt4_prev = autogen.config_list_from_json(
-    "OAI_CONFIG_LIST.json",
-    filter_dict={
-        "model": ["gpt-4-1106-preview"],
-    },
-)
-
-# OAI_CONFIG_LIST.json is needed! Check the Autogen repo for more info!
-config_list_gpt4 = autogen.config_list_from_json(
-    "OAI_CONFIG_LIST.json",
-    filter_dict={
-        "model": ["gpt-4"],
-    },
-)
-
-gpt4_prev_config = {
-    "cache_seed": 42,
-    "temperature": 0.7,
-    "top_p" : 1.0,
-    "config_list": config_list_gpt4_prev,
-    "timeout": 600,
-}
-
-gpt4_config = {
-    "cache_seed": 42,
-    "temperature": 0.7,
-    "top_p" : 1.0,
-    "config_list": config_list_gpt4,
-    "timeout": 600,
-}
-
-gpt4_json_config = deepcopy(gpt4_prev_config)
-gpt4_json_config["temperature"] = 0.7
-gpt4_json_config["config_list"][0]["response_format"] = { "type": "json_object" }
-
-gpt4_json_engineer_config = deepcopy(gpt4_prev_config)
-gpt4_json_engineer_config["temperature"] = 0.0
-gpt4_json_engineer_config["config_list"][0]["response_format"] = { "type": "json_object" }
+# OAI_CONFIG_LIST.json is needed! Check the Autogen repo for more info! It's read when the first agents are created
+def get_manager_config():
+    # The group chat managers pick the speakers themselves, the config isn't used for requests
+    return get_llm_config("gpt-4", temperature=0.7, top_p=1.0)
 
 def is_termination_msg(content) -> bool:
     have_content = content.get("content", None) is not None
@@ -63,17 +30,17 @@ class JSONSchemaAgent(UserProxyAgent):
         preps_layout = ['in front', 'on', 'in the corner', 'in the middle of']
         preps_objs = ['on', 'left of', 'right of', 'in front', 'behind', 'under', 'above']
 
-        json_obj_new = json.loads(message["content"])
+        json_obj_new = repair_initial(json.loads(message["content"]))
         try:
             json_obj_new_ids = [item["new_object_id"] for item in json_obj_new["objects_in_room"]]
         except:
             return "Use 'new_object_id' instead of 'object_id'!"
 
         is_success  = False
-        try:
-            validate(instance=json_obj_new, schema=initial_schema)
+        e = get_validation_error(get_validator(initial_schema), json_obj_new)
+        if e is None:
             is_success = True
-        except Exception as e:
+        else:
             feedback = str(e.message)
             if e.validator == "enum":
                 if e.instance in json_obj_new_ids:
@@ -101,7 +68,7 @@ def create_agents(no_of_objects : int):
     )
     interior_designer = autogen.AssistantAgent(
         name = "Interior_designer",
-        llm_config = gpt4_json_config,
+        llm_config = get_llm_config("gpt-4-1106-preview", temperature=0.7, top_p=1.0, json_output=True),
         human_input_mode = "NEVER",
         is_termination_msg = is_termination_msg,
         system_message = f""" Interior Designer. Suggest {no_of_objects} essential new objects to be added to the room based on the user preference, general functionality of the room and the room size.
@@ -124,7 +91,7 @@ def create_agents(no_of_objects : int):
 
     interior_architect = autogen.AssistantAgent(
         name = "Interior_architect",
-        llm_config = gpt4_json_config,
+        llm_config = get_llm_config("gpt-4-1106-preview", temperature=0.7, top_p=1.0, json_output=True),
         human_input_mode = "NEVER",
         is_termination_msg = is_termination_msg,
         system_message = f""" Interior Architect. Your role is to analyze the user preference, think about where the optimal
@@ -160,7 +127,7 @@ def create_agents(no_of_objects : int):
 
     engineer = autogen.AssistantAgent(
         name = "Engineer",
-        llm_config = gpt4_json_engineer_config,
+        llm_config = get_llm_config("gpt-4-1106-preview", temperature=0.0, top_p=1.0, json_output=True),
         human_input_mode = "NEVER",
         is_termination_msg = is_termination_msg,
         system_message = f""" Engineer. You listen to the input by the Admin and create a JSON file.
@@ -181,5 +148,9 @@ def create_agents(no_of_objects : int):
         """
     )
 
+
+    use_response_cache(interior_designer)
+    use_response_cache(interior_architect)
+    use_response_cache(engineer)
     return user_proxy, json_schema_debugger, interior_designer, interior_architect, engineer
 
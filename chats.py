@@ -2,13 +2,37 @@ from autogen.agentchat.groupchat import GroupChat
 from autogen.agentchat.agent import Agent
 from autogen.agentchat.assistant_agent import AssistantAgent
 
+from metrics import start_conversation, end_conversation
+
 class GroupChat(GroupChat):
     def __init__(self, agents, messages, max_round=15):
         super().__init__(agents, messages, max_round)
         self.previous_speaker = None  # Keep track of the previous speaker
         self.counter = 0
+        # Metrics of the chat in progress. The managers run a shallow copy of the group chat (and make a new one when
+        # they are reset), the copies share the dict
+        self.metrics_state = {"conversation" : None}
+
+    def record_round(self, last_speaker: Agent):
+        # Called first in select_speaker, the last message ends the round of last_speaker
+        conversation = self.metrics_state["conversation"]
+        if conversation is None:
+            self.metrics_state["conversation"] = start_conversation(type(self).__name__)
+        else:
+            conversation.end_round(last_speaker.name, self.messages[-1]["content"])
+
+    def reset(self):
+        # The chat is over, the last round isn't followed by select_speaker if the chat ran out of rounds
+        conversation = self.metrics_state["conversation"]
+        if conversation is not None:
+            if len(self.messages) - 1 > len(conversation.rounds):
+                conversation.end_round(self.messages[-1]["name"], self.messages[-1]["content"])
+            end_conversation(conversation)
+            self.metrics_state["conversation"] = None
+        super().reset()
 
     def select_speaker(self, last_speaker: Agent, selector: AssistantAgent):
+        self.record_round(last_speaker)
         # Check if last message suggests a next speaker or termination
         last_message = self.messages[-1] if self.messages else None
         last_speaker_name = last_speaker.name if last_speaker else None
@@ -29,6 +53,7 @@ class ChatWithEngineer(GroupChat):
         self.counter = 0
 
     def select_speaker(self, last_speaker: Agent, selector: AssistantAgent):
+        self.record_round(last_speaker)
         # Check if last message suggests a next speaker or termination
         last_message = self.messages[-1] if self.messages else None
         last_speaker_name = last_speaker.name if last_speaker else None
@@ -48,6 +73,7 @@ class LayoutCorrectorGroupChat(GroupChat):
         self.previous_speaker = None
     
     def select_speaker(self, last_speaker: Agent, selector: AssistantAgent):
+        self.record_round(last_speaker)
         last_message = self.messages[-1] if self.messages else None
         last_speaker_name = last_speaker.name if last_speaker else None
 
@@ -69,6 +95,7 @@ class ObjectDeletionGroupChat(GroupChat):
         self.previous_speaker = None
     
     def select_speaker(self, last_speaker: Agent, selector: AssistantAgent):
+        self.record_round(last_speaker)
         last_message = self.messages[-1] if self.messages else None
         last_speaker_name = last_speaker.name if last_speaker else None
 
@@ -86,6 +113,7 @@ class LayoutRefinerGroupChat(GroupChat):
         self.counter = 0
 
     def select_speaker(self, last_speaker: Agent, selector: AssistantAgent):
+        self.record_round(last_speaker)
         # Check if last message suggests a next speaker or termination
         last_message = self.messages[-1] if self.messages else None
         last_speaker_name = last_speaker.name if last_speaker else None
@@ -0,0 +1,203 @@
+import numpy as np
+
+def is_thin_object(obj):
+    """
+    Returns True if the object is thin
+    """
+    size = obj["size_in_meters"]
+    return min(size.values()) > 0.0 and max(size.values()) / min(size.values()) >= 40.0
+
+class SpatialGrid:
+    """
+    Uniform grid over the XY footprint of the room, mapping every cell to the keys of the boxes overlapping it
+    """
+    def __init__(self, room_dimensions, cell_size=0.5):
+        self.cell_size = cell_size
+        self.shape = np.array([max(1, int(np.ceil(room_dimensions[0] / cell_size))), max(1, int(np.ceil(room_dimensions[1] / cell_size)))])
+        self.cells = {}
+        self.ranges = {}
+
+    def get_cell_range(self, low, high):
+        # Boxes reaching outside of the room are clamped to the border cells
+        i_min, j_min = np.clip(np.floor(np.asarray(low[:2]) / self.cell_size).astype(int), 0, self.shape - 1)
+        i_max, j_max = np.clip(np.floor(np.asarray(high[:2]) / self.cell_size).astype(int), 0, self.shape - 1)
+        return range(i_min, i_max + 1), range(j_min, j_max + 1)
+
+    def insert(self, key, low, high):
+        self.remove(key)
+        rows, cols = self.get_cell_range(low, high)
+        self.ranges[key] = (rows, cols)
+        for i in rows:
+            for j in cols:
+                self.cells.setdefault((i, j), set()).add(key)
+
+    def remove(self, key):
+        cell_range = self.ranges.pop(key, None)
+        if cell_range is None:
+            return
+        rows, cols = cell_range
+        for i in rows:
+            for j in cols:
+                self.cells[(i, j)].discard(key)
+
+    def query(self, low, high):
+        """
+        Returns the keys of the boxes sharing a cell with the box (low, high)
+        """
+        rows, cols = self.get_cell_range(low, high)
+        keys = set()
+        for i in rows:
+            for j in cols:
+                keys |= self.cells.get((i, j), set())
+        return keys
+
+class CollisionEngine:
+    """
+    Keeps the axis-aligned bounds of all placed objects in one contiguous array,
+    so that a candidate position (or a batch of them) is checked against the whole scene at once.
+    If the room dimensions are given, a spatial grid narrows the checks down to the objects nearby
+    """
+    def __init__(self, scene_graph=None, room_dimensions=None, capacity=64, cell_size=0.5):
+        self.bounds = np.zeros((capacity, 2, 3))  # (slot, min/max, x/y/z)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.slots = {}
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.grid = SpatialGrid(room_dimensions, cell_size) if room_dimensions is not None else None
+        if scene_graph is not None:
+            for obj in scene_graph:
+                if "position" in obj.keys():
+                    self.update(obj)
+
+    @staticmethod
+    def get_half_extents(obj):
+        length, width, height = obj["size_in_meters"]["length"], obj["size_in_meters"]["width"], obj["size_in_meters"]["height"]
+        rot = obj["rotation"]["z_angle"]
+        if np.isclose(rot, 90.0) or np.isclose(rot, 270.0):
+            length, width = width, length
+        return np.array([length, width, height]) / 2
+
+    def _grow(self):
+        capacity = len(self.active)
+        self.bounds = np.concatenate([self.bounds, np.zeros_like(self.bounds)])
+        self.active = np.concatenate([self.active, np.zeros(capacity, dtype=bool)])
+        self.free_slots = list(range(2 * capacity - 1, capacity - 1, -1)) + self.free_slots
+
+    def update(self, obj):
+        """
+        Insert or refresh the bounds of an object from its current position
+        """
+        obj_id = obj["new_object_id"]
+        # Thin objects never collide
+        if "position" not in obj.keys() or is_thin_object(obj):
+            self.remove(obj_id)
+            return
+        if obj_id not in self.slots:
+            if not self.free_slots:
+                self._grow()
+            self.slots[obj_id] = self.free_slots.pop()
+        slot = self.slots[obj_id]
+        center = np.array([obj["position"]["x"], obj["position"]["y"], obj["position"]["z"]])
+        half = self.get_half_extents(obj)
+        self.bounds[slot, 0] = center - half
+        self.bounds[slot, 1] = center + half
+        self.active[slot] = True
+        if self.grid is not None:
+            self.grid.insert(slot, self.bounds[slot, 0], self.bounds[slot, 1])
+
+    def remove(self, obj_id):
+        slot = self.slots.pop(obj_id, None)
+        if slot is not None:
+            self.active[slot] = False
+            self.free_slots.append(slot)
+            if self.grid is not None:
+                self.grid.remove(slot)
+
+    def get_others(self, obj, low, high):
+        """
+        Returns the mask of the placed objects other than obj that may overlap the box (low, high)
+        """
+        if self.grid is not None:
+            others = np.zeros(len(self.active), dtype=bool)
+            others[list(self.grid.query(low, high))] = True
+        else:
+            others = self.active.copy()
+        own_slot = self.slots.get(obj["new_object_id"])
+        if own_slot is not None:
+            others[own_slot] = False
+        return others
+
+    def place(self, obj, position):
+        """
+        Assign the position to the object and keep the bounds in sync
+        """
+        obj["position"] = position
+        self.update(obj)
+
+    def unplace(self, obj):
+        if "position" in obj.keys():
+            del obj["position"]
+        self.remove(obj["new_object_id"])
+
+    def collisions(self, obj, centers):
+        """
+        Returns a boolean array telling for each candidate center (K x 3) whether the object
+        would collide with any other placed object
+        """
+        centers = np.atleast_2d(np.asarray(centers, dtype=float))
+        if is_thin_object(obj):
+            return np.zeros(len(centers), dtype=bool)
+        half = self.get_half_extents(obj)
+        others = self.get_others(obj, (centers - half).min(axis=0), (centers + half).max(axis=0))
+        if not others.any():
+            return np.zeros(len(centers), dtype=bool)
+        min1, max1 = (centers - half)[:, None, :], (centers + half)[:, None, :]
+        min2, max2 = self.bounds[others, 0][None, :, :], self.bounds[others, 1][None, :, :]
+        overlap = (min1 < max2) & (max1 > min2) & (np.abs(min1 - max2) > 1e-3) & (np.abs(max1 - min2) > 1e-3)
+        return overlap.all(axis=2).any(axis=1)
+
+    def collides(self, obj):
+        """
+        Returns whether the object collides with any other placed object at its current position
+        """
+        if "position" not in obj.keys():
+            return False
+        center = (obj["position"]["x"], obj["position"]["y"], obj["position"]["z"])
+        return bool(self.collisions(obj, center)[0])
+
+    def free_regions(self, obj, box, tolerance=1e-3):
+        """
+        Subtracts the footprints of the placed objects, grown by the half extents of the object, from the box of
+        feasible centers (x_min, x_max, y_min, y_max, z_min, z_max) and returns the free cells as (min, max) arrays
+        """
+        low, high = np.minimum(box[0::2], box[1::2]), np.maximum(box[0::2], box[1::2])
+        if is_thin_object(obj):
+            return low[None, :], high[None, :]
+        half = self.get_half_extents(obj)
+        others = self.get_others(obj, low - half, high + half)
+        if not others.any():
+            return low[None, :], high[None, :]
+
+        # Centers strictly inside these intervals (minus the tolerance) collide
+        blocked_low = self.bounds[others, 0] - half + tolerance
+        blocked_high = self.bounds[others, 1] + half - tolerance
+        keep = np.all((blocked_low < high) & (blocked_high > low) & (blocked_low < blocked_high), axis=1)
+        blocked_low, blocked_high = blocked_low[keep], blocked_high[keep]
+
+        # Split every axis at the block edges, each cell is then either fully free or fully blocked
+        cells_low, cells_high, inside = [], [], []
+        for axis in range(3):
+            points = np.unique(np.clip(np.concatenate(([low[axis], high[axis]], blocked_low[:, axis], blocked_high[:, axis])), low[axis], high[axis]))
+            axis_low, axis_high = (points, points) if len(points) == 1 else (points[:-1], points[1:])
+            mid = (axis_low + axis_high) / 2
+            cells_low.append(axis_low)
+            cells_high.append(axis_high)
+            inside.append((blocked_low[:, axis, None] < mid[None, :]) & (mid[None, :] < blocked_high[:, axis, None]))
+
+        covered = np.zeros((len(cells_low[0]), len(cells_low[1]), len(cells_low[2])), dtype=bool)
+        for in_x, in_y, in_z in zip(*inside):
+            covered |= in_x[:, None, None] & in_y[None, :, None] & in_z[None, None, :]
+
+        i, j, k = np.nonzero(~covered)
+        regions_low = np.stack([cells_low[0][i], cells_low[1][j], cells_low[2][k]], axis=1)
+        regions_high = np.stack([cells_high[0][i], cells_high[1][j], cells_high[2][k]], axis=1)
+        return regions_low, regions_high
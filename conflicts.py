@@ -0,0 +1,195 @@
+import networkx as nx
+
+from scene import SceneGraph, get_graph_analysis, get_own_rotation, invalidate_graph_analysis
+from utils import ROOM_LAYOUT_ELEMENTS, add_object_edges, build_graph, get_object_from_scene_graph, find_corner_occupancy, find_corner_vacancy
+from utils import check_corner_occupancy, check_corner_relationship_impossibilities, check_corner_relationships, check_impossible_relationships
+from utils import check_size_conflicts, check_wall_relationship_impossibilities, find_room_layout_conflicts
+
+class ConflictTracker:
+    """
+    Keeps the constraint graph of a scene graph and its conflicts up to date while the objects are corrected one by one.
+    After an edit, only the objects it can affect are checked again: the spatial conflicts of the object, its parents,
+    their children and its descendants, and the size conflicts of the object, its ancestors and its descendants
+    """
+    # In the order of get_conflicts
+    checkers = [
+        check_corner_relationship_impossibilities,
+        find_room_layout_conflicts,
+        check_corner_relationships,
+        check_impossible_relationships,
+        check_wall_relationship_impossibilities
+    ]
+
+    def __init__(self, G, scene_graph, user_input, room_priors, verbose=False):
+        self.G = G if G is not None else build_graph(scene_graph)
+        # The rotation cache of the SceneGraph tells which objects inherit the rotation of an edited one
+        self.scene_graph = scene_graph if isinstance(scene_graph, SceneGraph) else SceneGraph(scene_graph)
+        self.user_input = user_input
+        self.room_priors = room_priors
+        self.verbose = verbose
+        self.results = [{} for _ in self.checkers]  # node -> conflicts, for every checker
+        self.size_results = {}
+        self.cluster_sizes = {}
+        self.cluster_orders = {}  # node -> children of its memoized cluster, in the order they were visited
+        # Nodes to check again, None if all of them are
+        self.dirty = None
+        self.size_dirty = None
+
+    def get_neighbourhood(self, obj_id):
+        # The nodes whose spatial and size conflicts depend on the edges of the object
+        if obj_id not in self.G:
+            return set(), set()
+        parents = set(self.G.predecessors(obj_id))
+        siblings = {c for p in parents for c in self.G.successors(p)}
+        descendants = nx.descendants(self.G, obj_id)
+        spatial = {obj_id} | parents | siblings | descendants
+        size = {obj_id} | descendants | nx.ancestors(self.G, obj_id)
+        return spatial, size
+
+    def get_rotation_dependents(self, obj_id):
+        # The object and the objects inheriting its rotation through the first parent of their placement. Found from
+        # the placements, the rotation cache only knows the rotations resolved since the scene graph was rebuilt
+        children = {}
+        for obj in self.scene_graph:
+            if get_own_rotation(obj) is None and len(obj["placement"]["objects_in_room"]) > 0:
+                children.setdefault(obj["placement"]["objects_in_room"][0]["object_id"], []).append(obj["new_object_id"])
+        stack, dependents = [obj_id], {obj_id}
+        while stack:
+            for child in children.get(stack.pop(), []):
+                if child not in dependents:
+                    dependents.add(child)
+                    stack.append(child)
+        return dependents
+
+    def mark(self, spatial, size):
+        if self.dirty is not None:
+            self.dirty |= spatial
+        if self.size_dirty is not None:
+            self.size_dirty |= size
+        for node in size:
+            self.cluster_sizes.pop(node, None)
+
+    def get_children_order(self, node, analysis):
+        # The children in the order get_cluster_size visits them
+        return [edge[1] for edge in analysis.sort_edges(list(self.G.out_edges(node)), reverse=True)]
+
+    def drop_reordered_clusters(self):
+        # The children of a cluster are visited in the topological order, which any edit can change. The clusters whose
+        # children now come in another order are computed again, with the clusters containing them
+        analysis = get_graph_analysis(self.G)
+        stack = [node for node in self.cluster_sizes if self.cluster_orders.get(node) != self.get_children_order(node, analysis)]
+        while stack:
+            node = stack.pop()
+            if self.cluster_sizes.pop(node, None) is not None:
+                stack.extend(analysis.predecessors[node])
+
+    def mark_corners(self, vacancy):
+        # The conflicts of the objects in the corners list the vacant corners
+        if set(find_corner_vacancy(self.G)) != vacancy:
+            corner_nodes = {v for u, v, data in self.G.edges(data=True) if data["weight"]["preposition"] == "in the corner"}
+            self.mark(corner_nodes, set())
+
+    def update(self, obj_id):
+        """
+        To be called after the placement or the facing of the object is edited in the scene graph
+        """
+        rotated = (self.scene_graph.invalidate(obj_id) | self.get_rotation_dependents(obj_id)) & set(self.G.nodes())
+        vacancy = set(find_corner_vacancy(self.G))
+        spatial, size = self.get_neighbourhood(obj_id)
+        if obj_id in self.G:
+            self.G.remove_edges_from(list(self.G.in_edges(obj_id)))
+        add_object_edges(self.G, get_object_from_scene_graph(obj_id, self.scene_graph))
+        invalidate_graph_analysis(self.G)
+
+        new_spatial, new_size = self.get_neighbourhood(obj_id)
+        # The rotation may also be inherited through edges left out of the graph
+        rotated_spatial = rotated.union(*[self.G.successors(node) for node in rotated])
+        rotated_size = rotated.union(*[nx.ancestors(self.G, node) for node in rotated])
+        self.mark(spatial | new_spatial | rotated_spatial, size | new_size | rotated_size)
+        self.mark_corners(vacancy)
+
+    def remove(self, obj_ids):
+        """
+        Delete the objects from the scene graph and the graph
+        """
+        obj_ids = set(obj_ids)
+        vacancy = set(find_corner_vacancy(self.G))
+        spatial, size = set(), set()
+        for obj_id in obj_ids:
+            obj_spatial, obj_size = self.get_neighbourhood(obj_id)
+            spatial |= obj_spatial
+            size |= obj_size
+
+        self.scene_graph = SceneGraph([x for x in self.scene_graph if x["new_object_id"] not in obj_ids])
+        for obj_id in obj_ids:
+            if obj_id in self.G:
+                self.G.remove_node(obj_id)
+            for results in self.results + [self.size_results, self.cluster_sizes]:
+                results.pop(obj_id, None)
+        invalidate_graph_analysis(self.G)
+
+        self.mark(spatial - obj_ids, size - obj_ids)
+        self.mark_corners(vacancy)
+
+    def get_conflicts(self, with_objects=False):
+        """
+        Same as utils.get_conflicts on the current graph. With with_objects, the conflicts come with the set of
+        objects they were found on, as (conflict, objects) pairs
+        """
+        nodes = [node for node in self.G.nodes() if node not in ROOM_LAYOUT_ELEMENTS] if self.dirty is None else self.dirty & set(self.G.nodes())
+        # One call of each checker for all the nodes, the conflicts are then kept by node
+        for checker, results in zip(self.checkers, self.results):
+            for node in nodes:
+                results[node] = []
+            for conflict, node in checker(self.G, self.scene_graph, nodes=nodes, with_nodes=True):
+                results[node].append(conflict)
+        self.dirty = set()
+
+        conflicts = []
+        order = get_graph_analysis(self.G).order
+        for checker, results in zip(self.checkers, self.results):
+            if checker is check_corner_relationships:
+                occupied_corners = [set(v) for v in find_corner_occupancy(self.G).values() if len(v) > 1]
+                conflicts += list(zip(check_corner_occupancy(self.G, self.scene_graph), occupied_corners))
+            for node in order:
+                conflicts += [(conflict, {node}) for conflict in results.get(node, [])]
+        return conflicts if with_objects else [conflict for conflict, _ in conflicts]
+
+    def get_independent_conflicts(self):
+        """
+        The first conflict and the following ones whose objects, with their parents and children, don't overlap
+        with the ones of the conflicts already picked. Their corrections can be made at the same time
+        """
+        batch, taken = [], set()
+        for conflict, objects in self.get_conflicts(with_objects=True):
+            neighbourhood = set(objects)
+            for node in objects:
+                neighbourhood |= set(self.G.predecessors(node)) | set(self.G.successors(node))
+            neighbourhood -= set(ROOM_LAYOUT_ELEMENTS)
+            if neighbourhood & taken:
+                continue
+            batch.append(conflict)
+            taken |= neighbourhood
+        return batch
+
+    def get_size_conflicts(self):
+        """
+        Same as utils.get_size_conflicts on the current graph
+        """
+        nodes = list(self.G.nodes()) if self.size_dirty is None else self.size_dirty & set(self.G.nodes())
+        if self.size_dirty is not None:
+            # The objects on a room layout element are listed in the topological order, which any edit can change
+            nodes |= set(ROOM_LAYOUT_ELEMENTS) & set(self.G.nodes())
+            self.drop_reordered_clusters()
+        for node in nodes:
+            self.size_results[node] = []
+        for conflict, node in check_size_conflicts(self.G, self.scene_graph, self.user_input, self.room_priors, self.verbose, nodes=nodes, cluster_sizes=self.cluster_sizes, with_nodes=True):
+            self.size_results[node].append(conflict)
+        self.size_dirty = set()
+        analysis = get_graph_analysis(self.G)
+        self.cluster_orders = {node : self.get_children_order(node, analysis) for node in self.cluster_sizes}
+
+        conflicts = []
+        for node in analysis.reversed_order:
+            conflicts += self.size_results.get(node, [])
+        return conflicts
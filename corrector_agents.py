@@ -3,13 +3,14 @@ from autogen.agentchat.groupchat import GroupChat
 from autogen.agentchat.agent import Agent
 from autogen.agentchat.user_proxy_agent import UserProxyAgent
 from autogen.agentchat.assistant_agent import AssistantAgent
-from copy import deepcopy
-from jsonschema import validate
 import json
 import re
 
 from schemas import layout_corrector_schema, deletion_schema
+from schemas import get_validator, get_validation_error, repair_corrected
 from agents import is_termination_msg
+from llm_cache import use_response_cache
+from llm_backend import get_llm_config
 
 class JSONSchemaAgent(UserProxyAgent):
     def __init__(self, name : str, is_termination_msg):
@@ -23,13 +24,13 @@ class JSONSchemaAgent(UserProxyAgent):
         pattern = r'```json\s*([^`]+)\s*```' # Match the json object
         match = re.search(pattern, message["content"], re.DOTALL).group(1)
 
-        json_obj_new = json.loads(match)
+        json_obj_new = repair_corrected(json.loads(match))
 
         is_success  = False
-        try:
-            validate(instance=json_obj_new, schema=layout_corrector_schema)
+        e = get_validation_error(get_validator(layout_corrector_schema), json_obj_new)
+        if e is None:
             is_success = True
-        except Exception as e:
+        else:
             feedback = str(e.message)
             if e.validator == "enum":
                 if str(preps_objs) in e.message:
@@ -40,22 +41,6 @@ class JSONSchemaAgent(UserProxyAgent):
             return "SUCCESS"
         return feedback
 
-config_list_gpt4 = autogen.config_list_from_json(
-    "OAI_CONFIG_LIST.json",
-    filter_dict={
-        "model": ["gpt-4-1106-preview"],
-    },
-)
-
-gpt4_config = {
-    "cache_seed": 42,
-    "temperature": 0.0,
-    "config_list": config_list_gpt4,
-    "timeout": 600,
-}
-gpt4_json_config = deepcopy(gpt4_config)
-gpt4_json_config["config_list"][0]["response_format"] = { "type": "json_object" }
-
 def get_corrector_agents():
     user_proxy = autogen.UserProxyAgent(
         name="Admin",
@@ -72,7 +57,7 @@ def get_corrector_agents():
 
     spatial_corrector_agent = AssistantAgent(
         name="Spatial_corrector_agent",
-        llm_config=gpt4_config,
+        llm_config=get_llm_config("gpt-4-1106-preview", temperature=0.0),
         is_termination_msg=is_termination_msg,
         human_input_mode="NEVER",
         system_message=f"""
@@ -90,7 +75,7 @@ def get_corrector_agents():
 
     object_deletion_agent = AssistantAgent(
         name="Object_deletion_agent",
-        llm_config=gpt4_json_config,
+        llm_config=get_llm_config("gpt-4-1106-preview", temperature=0.0, json_output=True),
         is_termination_msg=is_termination_msg,
         human_input_mode="NEVER",
         system_message=f"""
@@ -100,4 +85,7 @@ def get_corrector_agents():
         {deletion_schema}
         """
     )
+
+    use_response_cache(spatial_corrector_agent)
+    use_response_cache(object_deletion_agent)
     return user_proxy, json_schema_debugger, spatial_corrector_agent, object_deletion_agent
\ No newline at end of file
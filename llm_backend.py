@@ -0,0 +1,214 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from copy import deepcopy
+
+import autogen
+
+from rate_limit import get_model, get_rate_limiter
+from metrics import record_llm_call
+
+CONFIG_PATH = "OAI_CONFIG_LIST.json"
+
+@functools.lru_cache(maxsize=None)
+def load_config_lists(path=CONFIG_PATH):
+    # Read on first use and shared by all the agent modules
+    return autogen.config_list_from_json(path)
+
+@functools.lru_cache(maxsize=None)
+def load_config_list(model, path=CONFIG_PATH):
+    config_list = [config for config in load_config_lists(path) if config.get("model") == model]
+    if len(config_list) == 0:
+        logging.warning(f"No config for {model} in {path}, only the replay backend can be used")
+        config_list = [{"model" : model, "api_key" : "offline"}]
+    return config_list
+
+def get_config_list(model, path=CONFIG_PATH):
+    """
+    The config list of the model in the config file. Without an entry for the model, a stand-in entry is returned
+    so that the agents can still be created and replayed offline, requests to the API fail with it
+    """
+    return deepcopy(load_config_list(model, path))
+
+def get_llm_config(model, temperature, top_p=None, json_output=False):
+    """
+    The llm_config of an agent using the model. With json_output, the model is asked to answer with a JSON object
+    """
+    config_list = get_config_list(model)
+    if json_output:
+        for config in config_list:
+            config["response_format"] = { "type": "json_object" }
+    llm_config = {
+        "cache_seed": None,  # Cached by llm_cache instead
+        "temperature": temperature,
+        "config_list": config_list,
+        "timeout": 600,
+    }
+    if top_p is not None:
+        llm_config["top_p"] = top_p
+    return llm_config
+
+def normalize_content(content):
+    # The prompts are indented f-strings, the indentation doesn't change the request
+    if isinstance(content, str):
+        return "\n".join([line.strip() for line in content.strip().splitlines()])
+    return content
+
+def make_key(model, system_message, messages, temperature, response_format):
+    """
+    Hash of the normalized request
+    """
+    request = {
+        "model" : model,
+        "system_message" : normalize_content(system_message),
+        "messages" : [{k : normalize_content(v) for k, v in message.items() if k != "context"} for message in messages],
+        "temperature" : temperature,
+        "response_format" : response_format,
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+def get_request_key(recipient, messages):
+    # Key of the request the agent would send for messages
+    llm_config = recipient.llm_config
+    model_config = llm_config["config_list"][0] if llm_config.get("config_list") else llm_config
+    return make_key(
+        get_model(recipient),
+        recipient.system_message,
+        messages,
+        llm_config.get("temperature"),
+        model_config.get("response_format")
+    )
+
+class OpenAIBackend:
+    """
+    Sends the requests to the API of the agent's config list. calls and time (in seconds) count the requests
+    and the time spent waiting for them, summed over the threads. Each request is also counted in the metrics
+    of the conversation it belongs to
+    """
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.lock = threading.Lock()
+
+    def generate(self, recipient, messages, sender=None, config=None):
+        if messages is None:
+            messages = recipient._oai_messages[sender]
+        start_time = time.perf_counter()
+        final, reply, usage = self.request(recipient, messages, sender, config)
+        llm_time = time.perf_counter() - start_time
+        with self.lock:
+            self.calls += 1
+            self.time += llm_time
+        usage = usage if usage is not None else {}
+        record_llm_call(llm_time, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        return final, reply
+
+    def request(self, recipient, messages, sender, config):
+        # The request of autogen's generate_oai_reply, after waiting for the rate limiter of the model.
+        # Returns the token usage of the response along with the reply
+        client = recipient.client if config is None else config
+        if client is None:
+            return False, None, None
+        rate_limiter = get_rate_limiter(get_model(recipient))
+        with rate_limiter if rate_limiter is not None else nullcontext():
+            response = client.create(context=messages[-1].pop("context", None), messages=recipient._oai_system_message + messages)
+        usage = None
+        if getattr(response, "usage", None) is not None:
+            usage = {"prompt_tokens" : response.usage.prompt_tokens, "completion_tokens" : response.usage.completion_tokens}
+        return True, client.extract_text_or_function_call(response)[0], usage
+
+    def stats(self):
+        with self.lock:
+            return {"calls" : self.calls, "time" : self.time}
+
+class RecordingBackend(OpenAIBackend):
+    """
+    Sends the requests to the API and appends every request and its reply to the transcript file at path (JSON lines)
+    """
+    def __init__(self, path="llm_transcript.jsonl"):
+        super().__init__()
+        self.path = path
+        self.file_lock = threading.Lock()
+
+    def request(self, recipient, messages, sender, config):
+        start_time = time.perf_counter()
+        final, reply, usage = super().request(recipient, messages, sender, config)
+        if final and reply is not None:
+            record = {
+                "key" : get_request_key(recipient, messages),
+                "agent" : recipient.name,
+                "model" : get_model(recipient),
+                "messages" : [{k : v for k, v in message.items() if k != "context"} for message in messages],
+                "reply" : reply,
+                "usage" : usage,
+                "duration" : time.perf_counter() - start_time
+            }
+            with self.file_lock:
+                with open(self.path, "a") as file:
+                    file.write(json.dumps(record) + "\n")
+        return final, reply, usage
+
+class ReplayBackend(OpenAIBackend):
+    """
+    Answers the requests with the replies recorded by RecordingBackend, without any network access. The same request
+    recorded more than once gets its replies in the recorded order. latency is the time (in seconds) each reply takes,
+    None for no wait and "recorded" for the recorded duration of the request
+    """
+    def __init__(self, path="llm_transcript.jsonl", latency=None):
+        super().__init__()
+        self.path = path
+        self.latency = latency
+        self.records = {}
+        self.replayed = {}
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records.setdefault(record["key"], []).append(record)
+
+    def request(self, recipient, messages, sender, config):
+        key = get_request_key(recipient, messages)
+        with self.lock:
+            records = self.records.get(key)
+            if records is None:
+                raise KeyError(f"No reply of {recipient.name} recorded in {self.path} for the request {key}")
+            i = self.replayed.get(key, 0)
+            self.replayed[key] = i + 1
+        record = records[min(i, len(records) - 1)]
+        latency = record["duration"] if self.latency == "recorded" else self.latency
+        if latency:
+            time.sleep(latency)
+        return True, record["reply"], record.get("usage")
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """
+    The backend used by the agents, given by the IDESIGN_LLM_BACKEND environment variable: "record:<path>",
+    "replay:<path>" or the API by default
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            mode, _, path = os.environ.get("IDESIGN_LLM_BACKEND", "").partition(":")
+            if mode == "record":
+                _backend = RecordingBackend(path or "llm_transcript.jsonl")
+            elif mode == "replay":
+                _backend = ReplayBackend(path or "llm_transcript.jsonl")
+            else:
+                _backend = OpenAIBackend()
+        return _backend
+
+def set_backend(backend):
+    """
+    Replace the backend used by the agents, any object with generate(recipient, messages, sender, config) works
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
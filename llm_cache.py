@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from autogen import Agent, ConversableAgent
+
+from llm_backend import RecordingBackend, get_backend, get_request_key
+from metrics import record_llm_call
+
+class ResponseCache:
+    """
+    LLM responses stored in a local SQLite file, keyed by the hash of the request (see make_key).
+    Entries older than max_age (in seconds) are dropped, and the least recently used ones are evicted
+    once there are more than max_entries of them or they take more than max_size bytes, at most eviction_batch
+    rows per query
+    """
+    def __init__(self, path="llm_cache.db", max_entries=100000, max_size=512 * 1024 * 1024, max_age=30 * 24 * 3600, eviction_batch=64):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.max_age = max_age
+        self.eviction_batch = eviction_batch
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # The chats of the parallel stages share the connection
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, size INTEGER, created REAL, accessed REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self.connection.commit()
+        # Running totals of the entries, so that a write doesn't scan the table
+        self.count, self.size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    def get(self, key):
+        """
+        The cached response, None if there isn't any
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, created, size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                self.count, self.size = self.count - 1, self.size - row[2]
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        value = json.dumps(value)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.count, self.size = self.count - 1, self.size - row[0]
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, value, len(value), now, now))
+            self.count, self.size = self.count + 1, self.size + len(value)
+            self.evict(now)
+            self.connection.commit()
+
+    def evict(self, now):
+        # Called with the lock held
+        if self.max_age is not None:
+            count, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE created < ?", (now - self.max_age,)).fetchone()
+            if count > 0:
+                self.connection.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age,))
+                self.count, self.size = self.count - count, self.size - size
+                self.evictions += count
+        # Least recently used first, a batch at a time through the index on accessed
+        while self.count > self.max_entries or self.size > self.max_size:
+            sizes = self.connection.execute("SELECT size FROM responses ORDER BY accessed LIMIT ?", (self.eviction_batch,)).fetchall()
+            if len(sizes) == 0:
+                break
+            n = 0
+            while n < len(sizes) and (self.count > self.max_entries or self.size > self.max_size):
+                self.count, self.size = self.count - 1, self.size - sizes[n][0]
+                n += 1
+            self.connection.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)", (n,))
+            self.evictions += n
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+            self.count, self.size = 0, 0
+
+    def stats(self):
+        with self.lock:
+            count, size = self.count, self.size
+        requests = self.hits + self.misses
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "hit_rate" : self.hits / requests if requests > 0 else 0.0,
+            "evictions" : self.evictions,
+            "entries" : count,
+            "size" : size
+        }
+
+_response_cache = None
+_response_cache_set = False
+
+def get_response_cache():
+    """
+    The cache used by the agents, by default a ResponseCache in the file given by the IDESIGN_LLM_CACHE
+    environment variable (llm_cache.db). None if caching is disabled
+    """
+    global _response_cache, _response_cache_set
+    if not _response_cache_set:
+        _response_cache = ResponseCache(os.environ.get("IDESIGN_LLM_CACHE", "llm_cache.db"))
+        _response_cache_set = True
+    return _response_cache
+
+def set_response_cache(cache):
+    """
+    Replace the cache used by the agents, any object with get(key) and set(key, value) works. None disables caching
+    """
+    global _response_cache, _response_cache_set
+    _response_cache = cache
+    _response_cache_set = True
+
+def cached_oai_reply(recipient, messages=None, sender=None, config=None):
+    if messages is None:
+        messages = recipient._oai_messages[sender]
+    cache = get_response_cache()
+    backend = get_backend()
+    if cache is None:
+        return backend.generate(recipient, messages, sender, config)
+    key = get_request_key(recipient, messages)
+    start_time = time.perf_counter()
+    # A recording backend gets every request, the transcript has to be complete for the replay
+    reply = cache.get(key) if not isinstance(backend, RecordingBackend) else None
+    if reply is not None:
+        record_llm_call(time.perf_counter() - start_time, cached=True)
+    else:
+        final, reply = backend.generate(recipient, messages, sender, config)
+        if not final or reply is None:
+            return final, reply
+        cache.set(key, reply)
+    return True, reply
+
+def use_response_cache(agent):
+    """
+    Put the response cache and the backend (see llm_backend) in front of the LLM calls of the agent, after its termination checks
+    """
+    position = next(i for i, f in enumerate(agent._reply_func_list) if f["reply_func"] is ConversableAgent.generate_oai_reply)
+    agent.register_reply([Agent, None], cached_oai_reply, position=position)
+    return agent
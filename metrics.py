@@ -0,0 +1,241 @@
+import contextvars
+import functools
+import json
+import threading
+import time
+
+# The design, stage and conversation the current thread is working on
+_metrics = contextvars.ContextVar("metrics", default=None)
+_stage = contextvars.ContextVar("stage", default=None)
+_conversation = contextvars.ContextVar("conversation", default=None)
+
+ROUND_BUCKETS = [1, 2, 3, 4, 6, 8, 10, 15]
+
+def new_counters():
+    return {"llm_calls" : 0, "cache_hits" : 0, "prompt_tokens" : 0, "completion_tokens" : 0, "llm_time" : 0.0}
+
+class Conversation:
+    """
+    One group chat: the wall time and the LLM usage of each round, and whether the reply was accepted by the schema debugger
+    """
+    def __init__(self, metrics, stage, chat):
+        self.metrics = metrics
+        self.stage = stage
+        self.chat = chat
+        self.start_time = self.round_start_time = time.perf_counter()
+        self.time = None
+        self.rounds = []
+        self.counters = new_counters() # Of the round in progress
+        self.success = True
+        self.rounds_to_success = None
+        self.debugger_retries = 0
+
+    def add_llm_call(self, llm_time, prompt_tokens=0, completion_tokens=0, cached=False):
+        self.counters["llm_calls"] += 1
+        self.counters["cache_hits"] += int(cached)
+        self.counters["prompt_tokens"] += prompt_tokens or 0
+        self.counters["completion_tokens"] += completion_tokens or 0
+        self.counters["llm_time"] += llm_time
+
+    def end_round(self, agent, content):
+        now = time.perf_counter()
+        self.rounds.append({"agent" : agent, "time" : now - self.round_start_time, **self.counters})
+        self.round_start_time = now
+        self.counters = new_counters()
+        if agent == "Json_schema_debugger":
+            self.success = "SUCCESS" in str(content)
+            if self.success and self.rounds_to_success is None:
+                self.rounds_to_success = len(self.rounds)
+            elif not self.success:
+                self.debugger_retries += 1
+
+    def end(self):
+        self.time = time.perf_counter() - self.start_time
+        if self.success and self.rounds_to_success is None:
+            # Without the schema debugger, the first reply is taken
+            self.rounds_to_success = len(self.rounds)
+
+    def to_dict(self):
+        return {
+            "stage" : self.stage,
+            "chat" : self.chat,
+            "time" : self.time,
+            "rounds" : self.rounds,
+            "success" : self.success,
+            "rounds_to_success" : self.rounds_to_success,
+            "debugger_retries" : self.debugger_retries
+        }
+
+class Metrics:
+    """
+    Wall time of the stages of a design, and the rounds, LLM calls, tokens and cache hits of its conversations.
+    Exported as JSON (to_json) or in the OpenMetrics text format (to_openmetrics)
+    """
+    def __init__(self):
+        self.stages = {}
+        self.conversations = []
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # The designs are sent to the worker processes of the placement
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def add_stage(self, stage, stage_time):
+        with self.lock:
+            entry = self.stages.setdefault(stage, {"runs" : 0, "time" : 0.0})
+            entry["runs"] += 1
+            entry["time"] += stage_time
+
+    def add_conversation(self, conversation):
+        with self.lock:
+            self.conversations.append(conversation.to_dict())
+
+    def to_dict(self):
+        with self.lock:
+            stages = {stage : {**entry, **new_counters()} for stage, entry in self.stages.items()}
+            conversations = list(self.conversations)
+        for conversation in conversations:
+            entry = stages.setdefault(conversation["stage"], {"runs" : 0, "time" : 0.0, **new_counters()})
+            for r in conversation["rounds"]:
+                for key in new_counters():
+                    entry[key] += r[key]
+        return {"stages" : stages, "conversations" : conversations}
+
+    def to_json(self, filename="metrics.json"):
+        with open(filename, "w") as file:
+            json.dump(self.to_dict(), file, indent=4)
+
+    def to_openmetrics(self):
+        """
+        The metrics in the OpenMetrics text format, ex. to be served to Prometheus
+        """
+        metrics = self.to_dict()
+        lines = []
+        def family(name, metric_type, unit=None, description=None):
+            lines.append(f"# TYPE {name} {metric_type}")
+            if unit is not None:
+                lines.append(f"# UNIT {name} {unit}")
+            if description is not None:
+                lines.append(f"# HELP {name} {description}")
+        def sample(name, labels, value):
+            labels = ",".join([f'{k}="{str(v)}"' for k, v in labels.items()])
+            lines.append(f"{name}{{{labels}}} {value}")
+
+        family("idesign_stage_seconds", "counter", "seconds", "Wall time of the stages")
+        for stage, entry in metrics["stages"].items():
+            sample("idesign_stage_seconds_total", {"stage" : stage}, entry["time"])
+        family("idesign_stage_runs", "counter", description="Runs of the stages")
+        for stage, entry in metrics["stages"].items():
+            sample("idesign_stage_runs_total", {"stage" : stage}, entry["runs"])
+
+        # Per stage, chat and agent
+        agents = {}
+        for conversation in metrics["conversations"]:
+            for r in conversation["rounds"]:
+                entry = agents.setdefault((conversation["stage"], conversation["chat"], r["agent"]), {"rounds" : 0, "time" : 0.0, **new_counters()})
+                entry["rounds"] += 1
+                entry["time"] += r["time"]
+                for key in new_counters():
+                    entry[key] += r[key]
+        labels = lambda key : {"stage" : key[0], "chat" : key[1], "agent" : key[2]}
+        family("idesign_round_seconds", "summary", "seconds", "Wall time of the rounds of the conversations")
+        for key, entry in agents.items():
+            sample("idesign_round_seconds_sum", labels(key), entry["time"])
+            sample("idesign_round_seconds_count", labels(key), entry["rounds"])
+        family("idesign_llm_seconds", "counter", "seconds", "Time spent waiting for the LLM")
+        for key, entry in agents.items():
+            sample("idesign_llm_seconds_total", labels(key), entry["llm_time"])
+        family("idesign_llm_calls", "counter", description="LLM requests, including the cache hits")
+        for key, entry in agents.items():
+            sample("idesign_llm_calls_total", labels(key), entry["llm_calls"])
+        family("idesign_llm_cache_hits", "counter", description="LLM requests answered by the response cache")
+        for key, entry in agents.items():
+            sample("idesign_llm_cache_hits_total", labels(key), entry["cache_hits"])
+        family("idesign_llm_tokens", "counter", description="Tokens used by the LLM requests")
+        for key, entry in agents.items():
+            sample("idesign_llm_tokens_total", {**labels(key), "type" : "prompt"}, entry["prompt_tokens"])
+            sample("idesign_llm_tokens_total", {**labels(key), "type" : "completion"}, entry["completion_tokens"])
+
+        # Per stage and chat
+        chats = {}
+        for conversation in metrics["conversations"]:
+            entry = chats.setdefault((conversation["stage"], conversation["chat"]), {"success" : 0, "failure" : 0, "retries" : 0, "rounds" : []})
+            entry["success" if conversation["success"] else "failure"] += 1
+            entry["retries"] += conversation["debugger_retries"]
+            if conversation["success"]:
+                entry["rounds"].append(conversation["rounds_to_success"])
+        labels = lambda key : {"stage" : key[0], "chat" : key[1]}
+        family("idesign_conversations", "counter", description="Conversations, by whether their reply was accepted")
+        for key, entry in chats.items():
+            sample("idesign_conversations_total", {**labels(key), "success" : "true"}, entry["success"])
+            sample("idesign_conversations_total", {**labels(key), "success" : "false"}, entry["failure"])
+        family("idesign_schema_retries", "counter", description="Replies rejected by the schema debugger")
+        for key, entry in chats.items():
+            sample("idesign_schema_retries_total", labels(key), entry["retries"])
+        family("idesign_rounds_to_success", "histogram", description="Rounds until the reply was accepted")
+        for key, entry in chats.items():
+            for bucket in ROUND_BUCKETS:
+                sample("idesign_rounds_to_success_bucket", {**labels(key), "le" : bucket}, len([n for n in entry["rounds"] if n <= bucket]))
+            sample("idesign_rounds_to_success_bucket", {**labels(key), "le" : "+Inf"}, len(entry["rounds"]))
+            sample("idesign_rounds_to_success_sum", labels(key), sum(entry["rounds"]))
+            sample("idesign_rounds_to_success_count", labels(key), len(entry["rounds"]))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+_default_metrics = Metrics()
+
+def get_metrics():
+    """
+    The metrics of the design the current thread is working on, the process wide ones outside of the stages
+    """
+    metrics = _metrics.get()
+    return metrics if metrics is not None else _default_metrics
+
+def measure_stage(function):
+    """
+    Decorator for the stages of IDesign: times the stage, and counts the conversations in it in the design's metrics
+    """
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        metrics = getattr(self, "metrics", None) or get_metrics()
+        metrics_token, stage_token = _metrics.set(metrics), _stage.set(function.__name__)
+        start_time = time.perf_counter()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            metrics.add_stage(function.__name__, time.perf_counter() - start_time)
+            _stage.reset(stage_token)
+            _metrics.reset(metrics_token)
+    return wrapper
+
+def in_current_context(function):
+    """
+    Wrap function for a thread pool, so that its calls are counted in the caller's design and stage
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs : context.copy().run(function, *args, **kwargs)
+
+def start_conversation(chat):
+    conversation = Conversation(get_metrics(), _stage.get(), chat)
+    _conversation.set(conversation)
+    return conversation
+
+def end_conversation(conversation):
+    conversation.end()
+    conversation.metrics.add_conversation(conversation)
+    if _conversation.get() is conversation:
+        _conversation.set(None)
+
+def record_llm_call(llm_time, prompt_tokens=0, completion_tokens=0, cached=False):
+    """
+    Count an LLM request in the round in progress of the current conversation
+    """
+    conversation = _conversation.get()
+    if conversation is not None:
+        conversation.add_llm_call(llm_time, prompt_tokens, completion_tokens, cached)
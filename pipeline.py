@@ -0,0 +1,66 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from IDesign import IDesign
+from rate_limit import set_rate_limit
+
+LLM_STAGES = ["create_initial_design", "correct_design", "refine_design"]
+
+def _place(i_design, cluster_kwargs, backtrack_kwargs):
+    # Runs in the process pool, the placed design is sent back to the event loop
+    i_design.create_object_clusters(**cluster_kwargs)
+    i_design.backtrack(**backtrack_kwargs)
+    return i_design
+
+class DesignPipeline:
+    """
+    Runs many design requests concurrently on one event loop. The chats of the LLM stages are synchronous, so they run in
+    a thread pool of max_requests threads while the event loop waits on them, and the requests to each model are bounded
+    by the limits in rate_limits ({model : {"max_concurrent" : ..., "requests_per_minute" : ...}}), which are shared by
+    all the requests. The CPU stages (create_object_clusters and backtrack) run in a pool of max_processes processes.
+    stage_kwargs gives the keyword arguments of each stage, ex. {"correct_design" : {"batch_conflicts" : True}}
+    """
+    def __init__(self, max_requests=16, max_processes=None, rate_limits=None, stage_kwargs=None):
+        self.max_requests = max_requests
+        self.stage_kwargs = stage_kwargs if stage_kwargs is not None else {}
+        for model, limits in (rate_limits or {}).items():
+            set_rate_limit(model, **limits)
+        self.thread_pool = ThreadPoolExecutor(max_workers=max_requests)
+        self.process_pool = ProcessPoolExecutor(max_workers=max_processes or os.cpu_count())
+
+    async def design(self, no_of_objects, user_input, room_dimensions):
+        """
+        Run the whole pipeline for one room and return its IDesign, placed and ready for to_json
+        """
+        loop = asyncio.get_running_loop()
+        i_design = IDesign(no_of_objects, user_input, room_dimensions)
+        for stage in LLM_STAGES:
+            kwargs = self.stage_kwargs.get(stage, {})
+            await loop.run_in_executor(self.thread_pool, functools.partial(getattr(i_design, stage), **kwargs))
+        return await loop.run_in_executor(
+            self.process_pool,
+            _place,
+            i_design,
+            self.stage_kwargs.get("create_object_clusters", {}),
+            self.stage_kwargs.get("backtrack", {})
+        )
+
+    async def design_many(self, requests, return_exceptions=True):
+        """
+        Run the pipeline for a list of (no_of_objects, user_input, room_dimensions), the results are in the same order.
+        With return_exceptions, a failed request gives its exception instead of cancelling the others
+        """
+        return await asyncio.gather(*[self.design(*request) for request in requests], return_exceptions=return_exceptions)
+
+    def close(self):
+        self.thread_pool.shutdown(wait=True)
+        self.process_pool.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        # Don't block the event loop while the pools finish
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
@@ -90,6 +90,8 @@ objects_in_room = {}
 file_path = "scene_graph.json"
 with open(file_path, 'r') as file:
     data = json.load(file)
+    if isinstance(data, dict):
+        data = data["objects_in_room"]
     for item in data:
         if item["new_object_id"] not in ["south_wall", "north_wall", "east_wall", "west_wall", "middle of the room", "ceiling"]:
             objects_in_room[item["new_object_id"]] = item
@@ -0,0 +1,137 @@
+import ast
+import json
+import re
+
+from utils import DELETE_INSTRUCTION, ROOM_LAYOUT_ELEMENTS, USER_PREFERENCE
+
+# Compact prompts for the corrector, the object deletion agent, the engineer and the refiner, used by the stages of
+# IDesign with compact_prompts. The verbose prompts are kept by default, the cached responses are for them
+
+CHARS_PER_TOKEN = 4
+# Keys of an object the spatial corrector changes or needs to place it, the style and the material are left out
+CORRECTOR_OBJECT_KEYS = ["new_object_id", "size_in_meters", "is_on_the_floor", "facing", "placement"]
+REPOSITION_PATTERN = re.compile(r"\n ?Object to reposition: (\{.*\})\s*$", re.DOTALL)
+
+def count_tokens(text):
+    # Estimate for the GPT models, about 4 characters per token, without loading a tokenizer
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def deduplicate(text):
+    # The lines and the sentences of the text without the repeated ones and the extra whitespace
+    lines, seen = [], set()
+    for line in text.splitlines():
+        sentences = []
+        for sentence in re.split(r"(?<=[.!?])\s+", " ".join(line.split())):
+            if sentence and sentence not in seen:
+                seen.add(sentence)
+                sentences.append(sentence)
+        if sentences:
+            lines.append(" ".join(sentences))
+    return "\n".join(lines)
+
+def fit(lines, optional_lines, token_budget=None, header=None):
+    """
+    The lines, followed by as many of the optional lines (under header) as fit in token_budget, all of them without
+    a budget. The lines are always kept, even over the budget
+    """
+    text = "\n".join(lines)
+    added = []
+    for line in optional_lines:
+        candidate = "\n".join([text] + ([header] if header is not None else []) + added + [line])
+        if token_budget is not None and count_tokens(candidate) > token_budget:
+            break
+        added.append(line)
+    if len(added) == 0:
+        return text
+    return "\n".join([text] + ([header] if header is not None else []) + added)
+
+def compact_object(obj):
+    return json.dumps({k : obj[k] for k in CORRECTOR_OBJECT_KEYS if k in obj}, separators=(",", ":"))
+
+def get_context_lines(G, obj_id):
+    """
+    The placement constraints of the subgraph around the object: the placement of its parents, the other objects
+    placed relative to them and the objects placed relative to the object, closest first
+    """
+    if G is None or obj_id not in G:
+        return []
+    edges = []
+    parents = [p for p in G.predecessors(obj_id) if p not in ROOM_LAYOUT_ELEMENTS]
+    for p in parents:
+        edges += list(G.in_edges(p, data=True))
+    for p in parents:
+        edges += [edge for edge in G.out_edges(p, data=True) if edge[1] != obj_id]
+    edges += list(G.out_edges(obj_id, data=True))
+    lines = []
+    for u, v, data in edges:
+        line = f"{v} '{data['weight']['preposition']}' {u}" + ("" if data["weight"]["adjacency"] else " (not adjacent)")
+        if line not in lines:
+            lines.append(line)
+    return lines
+
+def compact_conflict(conflict, G=None, token_budget=None):
+    """
+    The prompt of the spatial corrector for a conflict of utils.get_conflicts. The text is deduplicated and the object
+    to reposition only keeps the keys the corrector needs. With token_budget, the constraints of the subgraph around
+    the object in G are added while the prompt fits in it
+    """
+    match = REPOSITION_PATTERN.search(conflict)
+    obj = None
+    if match is not None:
+        try:
+            obj = ast.literal_eval(match.group(1))
+        except (ValueError, SyntaxError):
+            obj = None
+    if not isinstance(obj, dict) or "new_object_id" not in obj:
+        return deduplicate(conflict)
+    lines = [deduplicate(conflict[:match.start()]), "Object to reposition: " + compact_object(obj)]
+    context_lines = get_context_lines(G, obj["new_object_id"]) if token_budget is not None else []
+    return fit(lines, context_lines, token_budget, header="Current constraints around the object:")
+
+def compact_size_conflicts(conflicts, token_budget=None):
+    """
+    The prompts of the object deletion agent for the conflicts of utils.get_size_conflicts, in the same order. The
+    conflicts between the same objects are merged into one prompt, which gives the instruction and the user preference
+    once. The problems after the first one are left out if the prompt doesn't fit in token_budget
+    """
+    groups = {}
+    for conflict in conflicts:
+        problem, _, rest = conflict.partition(DELETE_INSTRUCTION)
+        candidates, _, user_input = rest.partition(USER_PREFERENCE)
+        candidates = [c for c in candidates.split(", ") if c]
+        group = groups.setdefault(frozenset(candidates), {"candidates" : candidates, "user_input" : user_input, "problems" : []})
+        problem = deduplicate(problem)
+        if problem not in group["problems"]:
+            group["problems"].append(problem)
+
+    prompts = []
+    for group in groups.values():
+        lines = [group["problems"][0], DELETE_INSTRUCTION.lstrip() + ", ".join(group["candidates"]), USER_PREFERENCE.lstrip() + group["user_input"]]
+        prompts.append(fit(lines, group["problems"][1:], token_budget, header="The same objects also cause:"))
+    return prompts
+
+def get_mentioned_object_ids(prompt, object_ids):
+    """
+    The ids of the objects whose names appear in the prompt of a block, ex. desk_1 and desk_2 for "in front of the desk",
+    so that the engineer only gets the objects it may place the new ones relative to
+    """
+    text = " " + re.sub(r"[^a-z0-9]+", " ", prompt.lower()) + " "
+    mentioned = []
+    for obj_id in object_ids:
+        name = re.sub(r"_\d+$", "", obj_id).replace("_", " ")
+        if f" {name}" in text and obj_id not in mentioned:
+            mentioned.append(obj_id)
+    return mentioned
+
+def compact_refiner_constraints(names, behind_or_in_front):
+    """
+    The constraints of the layout refiner, with the children that get the same constraint in one line
+    """
+    groups = {}
+    for name, check in zip(names, behind_or_in_front):
+        groups.setdefault(check, []).append(name)
+    lines = ["Constraints:"]
+    for check, group in groups.items():
+        prepositions = '`behind` or `in front`' if check else '`left of` or `right of`'
+        lines.append(f"Place objects {prepositions} of {', '.join(group)}!")
+    return "\n".join(lines)
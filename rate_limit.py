@@ -0,0 +1,66 @@
+import threading
+import time
+
+class RateLimiter:
+    """
+    Limits the LLM requests to one model across all the threads: at most max_concurrent requests in flight
+    and at most requests_per_minute started in any 60 second window. None means no limit
+    """
+    def __init__(self, max_concurrent=None, requests_per_minute=None):
+        self.max_concurrent = max_concurrent
+        self.requests_per_minute = requests_per_minute
+        self.in_flight = 0
+        self.started = [] # Start times of the requests in the last minute
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.started = [t for t in self.started if now - t < 60]
+                wait = None
+                if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+                    wait = 1.0 # Woken up by release
+                if self.requests_per_minute is not None and len(self.started) >= self.requests_per_minute:
+                    free_at = self.started[len(self.started) - self.requests_per_minute] + 60
+                    wait = free_at - now if wait is None else min(wait, free_at - now)
+                if wait is None:
+                    break
+                self.condition.wait(timeout=max(wait, 0.01))
+            self.in_flight += 1
+            self.started.append(now)
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def set_rate_limit(model, max_concurrent=None, requests_per_minute=None):
+    """
+    Set the limits for the requests to model, shared by all the agents using it
+    """
+    with _rate_limiters_lock:
+        _rate_limiters[model] = RateLimiter(max_concurrent, requests_per_minute)
+        return _rate_limiters[model]
+
+def get_rate_limiter(model):
+    """
+    The limiter of the model, None if its requests aren't limited
+    """
+    with _rate_limiters_lock:
+        return _rate_limiters.get(model)
+
+def get_model(agent):
+    llm_config = agent.llm_config
+    model_config = llm_config["config_list"][0] if llm_config.get("config_list") else llm_config
+    return model_config.get("model", llm_config.get("model"))
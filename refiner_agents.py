@@ -3,12 +3,13 @@ from autogen.agentchat.groupchat import GroupChat
 from autogen.agentchat.agent import Agent
 from autogen.agentchat.user_proxy_agent import UserProxyAgent
 from autogen.agentchat.assistant_agent import AssistantAgent
-from copy import deepcopy
-from jsonschema import validate
 import json
 
 from schemas import layout_refiner_schema
+from schemas import get_validator, get_validation_error, repair_refined
 from agents import is_termination_msg
+from llm_cache import use_response_cache
+from llm_backend import get_llm_config
 
 class JSONSchemaAgent(UserProxyAgent):
     def __init__(self, name : str, is_termination_msg):
@@ -19,14 +20,12 @@ class JSONSchemaAgent(UserProxyAgent):
         preps_layout = ["left-side", "right-side", "in the middle"]
         preps_objs = ['on', 'left of', 'right of', 'in front', 'behind', 'under', 'above']
 
-        json_obj_new = json.loads(message["content"])
-        if "items" in json_obj_new["children_objects"]:
-            json_obj_new = {"children_objects" : json_obj_new["children_objects"]["items"]}
+        json_obj_new = repair_refined(json.loads(message["content"]))
         is_success  = False
-        try:
-            validate(instance=json_obj_new, schema=layout_refiner_schema)
+        e = get_validation_error(get_validator(layout_refiner_schema), json_obj_new)
+        if e is None:
             is_success = True
-        except Exception as e:
+        else:
             feedback = str(e.message)
             if e.validator == "enum":
                 if str(preps_objs) in e.message:
@@ -37,22 +36,6 @@ class JSONSchemaAgent(UserProxyAgent):
             return "SUCCESS"
         return feedback
 
-config_list_gpt4 = autogen.config_list_from_json(
-    "OAI_CONFIG_LIST.json",
-    filter_dict={
-        "model": ["gpt-4-1106-preview"],
-    },
-)
-
-gpt4_config = {
-    "cache_seed": 42,
-    "temperature": 0.0,
-    "config_list": config_list_gpt4,
-    "timeout": 600,
-}
-gpt4_json_config = deepcopy(gpt4_config)
-gpt4_json_config["config_list"][0]["response_format"] = { "type": "json_object" }
-
 def get_refiner_agents():
     user_proxy = autogen.UserProxyAgent(
         name="Admin",
@@ -69,7 +52,7 @@ def get_refiner_agents():
 
     layout_refiner = autogen.AssistantAgent(
         name = "Layout_refiner",
-        llm_config = gpt4_json_config,
+        llm_config = get_llm_config("gpt-4-1106-preview", temperature=0.0, json_output=True),
         is_termination_msg = is_termination_msg,
         human_input_mode = "NEVER",
         system_message = """ Layout Refiner. Every time when the Admin speaks; you will look at the parent object and children objects, the first  
@@ -123,4 +106,6 @@ def get_refiner_agents():
         """
     )
 
+
+    use_response_cache(layout_refiner)
     return user_proxy, json_schema_debugger, layout_refiner
\ No newline at end of file
@@ -98,6 +98,8 @@ file_path = "scene_graph.json"
 
 with open(file_path, "r") as file:
     objects_in_room = json.load(file)
+    if isinstance(objects_in_room, dict):
+        objects_in_room = objects_in_room["objects_in_room"]
     
 for obj_in_room in objects_in_room:
     if "style" in obj_in_room and "material" in obj_in_room:
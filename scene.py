@@ -0,0 +1,316 @@
+import numpy as np
+import networkx as nx
+from weakref import WeakKeyDictionary
+
+
+LAYOUT_ROTATIONS = {
+    "west_wall" : 270.0,
+    "east_wall" : 90.0,
+    "north_wall" : 0.0,
+    "south_wall" : 180.0,
+    "middle of the room" : 0.0,
+    "ceiling" : 0.0
+}
+
+def get_own_rotation(obj):
+    """
+    The z-angle the object defines by itself (rotation, facing or a layout element id), None if it follows its parent
+    """
+    if "rotation" in obj.keys():
+        return obj["rotation"]["z_angle"]
+    elif "facing" in obj.keys() and obj["facing"] in LAYOUT_ROTATIONS.keys():
+        return LAYOUT_ROTATIONS[obj["facing"]]
+    elif obj["new_object_id"] in LAYOUT_ROTATIONS.keys():
+        return LAYOUT_ROTATIONS[obj["new_object_id"]]
+    return None
+
+class CompiledScene:
+    """
+    Indexed form of a scene graph for the placement solver. Objects get integer indices and the placement constraints
+    are stored as CSR adjacency lists (parent -> child), for the topological order, the children and the descendants.
+    The sizes, rotations and positions are not compiled, the solver reads and writes them on the objects
+    """
+    def __init__(self, scene_graph):
+        self.objects = list(scene_graph)
+        self.ids = [obj["new_object_id"] for obj in self.objects]
+        self.index = {obj_id : i for i, obj_id in enumerate(self.ids)}
+
+        # Constraints, the edges go from the referenced object to the constrained object
+        sources, targets, is_object = [], [], []
+        for i, obj in enumerate(self.objects):
+            if "placement" not in obj.keys():
+                continue
+            for constraint in obj["placement"]["room_layout_elements"]:
+                if constraint["layout_element_id"] in self.index:
+                    sources.append(self.index[constraint["layout_element_id"]])
+                    targets.append(i)
+                    is_object.append(False)
+            for constraint in obj["placement"]["objects_in_room"]:
+                if constraint["object_id"] in self.index:
+                    sources.append(self.index[constraint["object_id"]])
+                    targets.append(i)
+                    is_object.append(True)
+        self.edge_sources = np.array(sources, dtype=np.int32)
+        self.edge_targets = np.array(targets, dtype=np.int32)
+        self.edge_is_object = np.array(is_object, dtype=bool)  # False for the edges from room layout elements
+
+        self.children_indptr, self.children_edges = self.build_csr(self.edge_sources)
+        self.parents_indptr, self.parents_edges = self.build_csr(self.edge_targets)
+        self.order, self.rank = self.get_topological_order()
+
+    def build_csr(self, keys):
+        edges = np.argsort(keys, kind="stable").astype(np.int32)
+        indptr = np.zeros(len(self.objects) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(keys, minlength=len(self.objects)), out=indptr[1:])
+        return indptr, edges
+
+    def get_topological_order(self):
+        # Kahn's algorithm over the CSR adjacency
+        in_degree = np.diff(self.parents_indptr).copy()
+        order = list(np.flatnonzero(in_degree == 0))
+        for i in order:
+            for edge in self.children_edges[self.children_indptr[i]:self.children_indptr[i + 1]]:
+                child = self.edge_targets[edge]
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    order.append(child)
+        if len(order) != len(self.objects):
+            raise ValueError("The scene graph contains a cycle!")
+        order = np.array(order, dtype=np.int32)
+        rank = np.empty(len(self.objects), dtype=np.int32)
+        rank[order] = np.arange(len(self.objects), dtype=np.int32)
+        return order, rank
+
+    def get(self, obj_id):
+        """
+        Get the object by its id, None if it isn't in the scene
+        """
+        i = self.index.get(obj_id)
+        return self.objects[i] if i is not None else None
+
+    def get_children(self, obj_id):
+        """
+        Objects constrained relative to the object (not through a room layout element), in topological order
+        """
+        i = self.index[obj_id]
+        edges = self.children_edges[self.children_indptr[i]:self.children_indptr[i + 1]]
+        children = np.unique(self.edge_targets[edges[self.edge_is_object[edges]]])
+        return [self.objects[c] for c in children[np.argsort(self.rank[children])]]
+
+    def get_descendants(self, obj_id):
+        """
+        Ids of all the objects that depend on the object through the constraints
+        """
+        stack, visited = [self.index[obj_id]], set()
+        while stack:
+            i = stack.pop()
+            for child in self.edge_targets[self.children_edges[self.children_indptr[i]:self.children_indptr[i + 1]]]:
+                if child not in visited:
+                    visited.add(child)
+                    stack.append(child)
+        return {self.ids[i] for i in visited}
+
+class GraphAnalysis:
+    """
+    Topological order, rank in that order and predecessors of a constraint graph (networkx DiGraph),
+    computed once and shared by the conflict checkers until the graph is edited
+    """
+    def __init__(self, G):
+        self.order = list(nx.topological_sort(G))
+        self.reversed_order = list(reversed(self.order))
+        self.rank = {node : i for i, node in enumerate(self.order)}
+        self.predecessors = {node : list(G.predecessors(node)) for node in self.order}
+        self.number_of_nodes = G.number_of_nodes()
+
+    def get_order(self, nodes=None, reverse=False):
+        """
+        The nodes (all of them by default) in topological order, the ones not in the graph are left out
+        """
+        if nodes is None:
+            return self.reversed_order if reverse else self.order
+        return sorted([node for node in nodes if node in self.rank], key=lambda node : self.rank[node], reverse=reverse)
+
+    def sort_edges(self, edges, reverse=False):
+        """
+        Sort the edges (u, v, ...) by the rank of v in the topological order
+        """
+        return sorted(edges, key=lambda e : self.rank[e[1]], reverse=reverse)
+
+_graph_analyses = WeakKeyDictionary()
+
+def get_graph_analysis(G):
+    """
+    Cached analysis of the graph. The code editing the graph calls invalidate_graph_analysis, a graph whose number of
+    nodes changed is also analysed again. The lookup is O(1) (unlike number_of_edges), the checkers can call it for
+    every node
+    """
+    analysis = _graph_analyses.get(G)
+    if analysis is None or analysis.number_of_nodes != G.number_of_nodes():
+        analysis = GraphAnalysis(G)
+        _graph_analyses[G] = analysis
+    return analysis
+
+def invalidate_graph_analysis(G):
+    """
+    To be called after the edges of the graph are edited, ex. an edge replaced by another one
+    """
+    _graph_analyses.pop(G, None)
+
+class RotationResolver:
+    """
+    Memoized z-angles of the objects in a scene graph. An object without a rotation of its own takes the rotation of
+    its first parent, the parent chains are resolved once and only the subtree of an edited object is recomputed
+    """
+    def __init__(self, scene_graph):
+        self.scene_graph = scene_graph
+        self.rotations = {}
+        self.dependents = {}  # parent id -> ids of the objects inheriting its rotation
+
+    def get_parent(self, obj):
+        # The first object the rotation is inherited from, None for a root
+        parents = []
+        for x in obj["placement"]["objects_in_room"]:
+            parent = self.scene_graph.get(x["object_id"])
+            if parent is None:
+                print(f"Object {x['object_id']} not found in scene graph!")
+                raise ValueError("Object not found in scene graph!")
+            parents.append(parent)
+        return parents[0] if len(parents) > 0 else None
+
+    def resolve(self, obj):
+        """
+        Returns the z-angle of the object, resolving the chain of parents it inherits from
+        """
+        chain, seen = [], set()
+        while obj["new_object_id"] not in self.rotations:
+            rot = get_own_rotation(obj)
+            if rot is not None:
+                self.rotations[obj["new_object_id"]] = rot
+                break
+            if obj["new_object_id"] in seen:
+                raise ValueError("The rotations of the scene graph contain a cycle!")
+            chain.append(obj)
+            seen.add(obj["new_object_id"])
+            parent = self.get_parent(obj)
+            if parent is None:
+                self.rotations[obj["new_object_id"]] = 0.0
+                chain.pop()
+                break
+            self.dependents.setdefault(parent["new_object_id"], set()).add(obj["new_object_id"])
+            obj = parent
+        # Everything on the chain inherits the rotation found at its end
+        rot = self.rotations[obj["new_object_id"]]
+        for x in chain:
+            self.rotations[x["new_object_id"]] = rot
+        return rot
+
+    def resolve_all(self):
+        for obj in self.scene_graph:
+            self.resolve(obj)
+        return self.rotations
+
+    def invalidate(self, obj_id):
+        """
+        Drop the cached rotation of the object and of all the objects inheriting it, to be called after the
+        facing or the placement of the object is edited. Returns the ids of the objects whose rotation may change
+        """
+        stack, invalidated = [obj_id], {obj_id}
+        while stack:
+            obj_id = stack.pop()
+            self.rotations.pop(obj_id, None)
+            for dependent in self.dependents.pop(obj_id, ()):
+                if dependent not in invalidated:
+                    invalidated.add(dependent)
+                    stack.append(dependent)
+        return invalidated
+
+    def clear(self):
+        self.rotations = {}
+        self.dependents = {}
+
+class SceneGraph(list):
+    """
+    List of the objects in the scene that keeps an id -> object index up to date,
+    it can be passed wherever the helpers take a scene_graph list
+    """
+    def __init__(self, objects=()):
+        super().__init__(objects)
+        self.reindex()
+
+    def __reduce__(self):
+        return (SceneGraph, (list(self),))
+
+    def reindex(self):
+        # Like a linear scan, the first object with a given id wins
+        self.rotations = RotationResolver(self)
+        self.by_id = {}
+        for obj in self:
+            self.by_id.setdefault(obj["new_object_id"], obj)
+
+    def get(self, obj_id):
+        """
+        Get the object by its id, None if it isn't in the scene
+        """
+        return self.by_id.get(obj_id)
+
+    def get_rotation(self, obj):
+        """
+        Cached z-angle of an object of the scene graph
+        """
+        return self.rotations.resolve(obj)
+
+    def invalidate(self, obj_id):
+        """
+        To be called after the facing or the placement of an object is edited in place
+        """
+        return self.rotations.invalidate(obj_id)
+
+    def append(self, obj):
+        super().append(obj)
+        self.by_id.setdefault(obj["new_object_id"], obj)
+        self.rotations.clear()
+
+    def extend(self, objects):
+        objects = list(objects)
+        super().extend(objects)
+        for obj in objects:
+            self.by_id.setdefault(obj["new_object_id"], obj)
+        self.rotations.clear()
+
+    def __iadd__(self, objects):
+        self.extend(objects)
+        return self
+
+    def insert(self, index, obj):
+        super().insert(index, obj)
+        self.reindex()
+
+    def remove(self, obj):
+        super().remove(obj)
+        self.reindex()
+
+    def pop(self, index=-1):
+        obj = super().pop(index)
+        self.reindex()
+        return obj
+
+    def clear(self):
+        super().clear()
+        self.by_id = {}
+        self.rotations.clear()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.reindex()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.reindex()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.reindex()
+
+    def reverse(self):
+        super().reverse()
+        self.reindex()
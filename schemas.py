@@ -1,3 +1,6 @@
+import difflib
+from copy import deepcopy
+
 initial_schema = {
     "type" : "object",
     "properties":{
@@ -339,4 +342,117 @@ layout_refiner_schema = {
         },
     },
     "required" : ["children_objects"]
-}
\ No newline at end of file
+}
+
+LAYOUT_ELEMENTS = ["south_wall", "north_wall", "west_wall", "east_wall", "ceiling", "middle of the room"]
+LAYOUT_PREPOSITIONS = ["on", "in the corner"]
+OBJECT_PREPOSITIONS = ["on", "left of", "right of", "in front", "behind", "under", "above"]
+
+# Common ways the models miss the allowed values
+ALIASES = {
+    "in front of" : "in front",
+    "front" : "in front",
+    "left" : "left of",
+    "to the left of" : "left of",
+    "right" : "right of",
+    "to the right of" : "right of",
+    "behind of" : "behind",
+    "on top of" : "on",
+    "on top" : "on",
+    "below" : "under",
+    "beneath" : "under",
+    "underneath" : "under",
+    "over" : "above",
+    "corner" : "in the corner",
+    "in corner" : "in the corner",
+    "middle of the floor" : "middle of the room",
+    "middle of room" : "middle of the room",
+    "floor" : "middle of the room",
+}
+
+# jsonschema is imported with the first validator, only the agents validate
+_validators = {}
+
+def get_validator(schema):
+    """
+    Validator compiled on first use for the schema
+    """
+    from jsonschema.validators import validator_for
+    if id(schema) not in _validators:
+        validator_class = validator_for(schema)
+        validator_class.check_schema(schema)
+        _validators[id(schema)] = validator_class(schema)
+    return _validators[id(schema)]
+
+def get_validation_error(validator, instance):
+    """
+    The error jsonschema.validate would raise, None if the instance is valid
+    """
+    from jsonschema.exceptions import best_match
+    return best_match(validator.iter_errors(instance))
+
+def repair_value(value, allowed):
+    # Map a near miss (case, separators, aliases, typos) to the allowed value
+    if not isinstance(value, str) or value in allowed:
+        return value
+    normalized = " ".join(value.lower().replace("-", " ").split())
+    for candidate in [normalized, normalized.replace(" ", "_"), ALIASES.get(normalized)]:
+        if candidate in allowed:
+            return candidate
+    matches = difflib.get_close_matches(normalized, allowed, n=1, cutoff=0.85)
+    return matches[0] if matches else value
+
+def repair_key(elem, key, allowed):
+    if key in elem:
+        elem[key] = repair_value(elem[key], allowed)
+
+def repair_placement(placement):
+    if not isinstance(placement, dict):
+        return
+    for elem in placement.get("room_layout_elements", []):
+        if isinstance(elem, dict):
+            repair_key(elem, "layout_element_id", LAYOUT_ELEMENTS)
+            repair_key(elem, "preposition", LAYOUT_PREPOSITIONS)
+    for elem in placement.get("objects_in_room", []):
+        if isinstance(elem, dict):
+            if "object_id" not in elem and "new_object_id" in elem:
+                elem["object_id"] = elem.pop("new_object_id")
+            repair_key(elem, "preposition", OBJECT_PREPOSITIONS)
+
+def repair_initial(json_obj):
+    """
+    Fix the mechanical errors of the engineer output without asking the model again
+    """
+    json_obj = deepcopy(json_obj)
+    for item in json_obj.get("objects_in_room", []) if isinstance(json_obj, dict) else []:
+        if isinstance(item, dict):
+            if "new_object_id" not in item and "object_id" in item:
+                item["new_object_id"] = item.pop("object_id")
+            repair_placement(item.get("placement"))
+    return json_obj
+
+def repair_corrected(json_obj):
+    """
+    Fix the mechanical errors of the spatial corrector output without asking the model again
+    """
+    json_obj = deepcopy(json_obj)
+    corrected_object = json_obj.get("corrected_object") if isinstance(json_obj, dict) else None
+    if isinstance(corrected_object, dict):
+        if "new_object_id" not in corrected_object and "object_id" in corrected_object:
+            corrected_object["new_object_id"] = corrected_object.pop("object_id")
+        repair_placement(corrected_object.get("placement"))
+    return json_obj
+
+def repair_refined(json_obj):
+    """
+    Fix the mechanical errors of the layout refiner output without asking the model again
+    """
+    json_obj = deepcopy(json_obj)
+    if isinstance(json_obj, dict) and isinstance(json_obj.get("children_objects"), dict) and "items" in json_obj["children_objects"]:
+        json_obj = {"children_objects" : json_obj["children_objects"]["items"]}
+    for child in json_obj.get("children_objects", []) if isinstance(json_obj, dict) else []:
+        placement = child.get("placement") if isinstance(child, dict) else None
+        for elem in placement.get("children_objects", []) if isinstance(placement, dict) else []:
+            if isinstance(elem, dict):
+                repair_key(elem, "preposition", OBJECT_PREPOSITIONS)
+    return json_obj
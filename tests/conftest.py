@@ -0,0 +1,74 @@
+import os
+import random
+import sys
+
+import pytest
+
+# The modules are at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WALLS = ["south_wall", "north_wall", "west_wall", "east_wall"]
+OBJECT_PREPOSITIONS = ["left of", "right of", "in front", "behind", "on"]
+
+def build_object(obj_id, room_layout_elements=(), objects_in_room=(), size=(0.5, 0.5, 0.5), **keys):
+    """
+    An object of the scene graph. The constraints are (layout element, preposition) and (object, preposition) or
+    (object, preposition, is_adjacent) tuples, the other keys of the object can be given or replaced with keys
+    """
+    obj = {"new_object_id" : obj_id, "style" : "x", "material" : "y",
+           "size_in_meters" : {"length" : size[0], "width" : size[1], "height" : size[2]},
+           "is_on_the_floor" : True, "facing" : "north_wall",
+           "placement" : {"room_layout_elements" : [{"layout_element_id" : e, "preposition" : p} for e, p in room_layout_elements],
+                          "objects_in_room" : [{"object_id" : c[0], "preposition" : c[1], "is_adjacent" : c[2] if len(c) > 2 else True} for c in objects_in_room]}}
+    obj.update(keys)
+    return obj
+
+def get_random_constraints(rnd, object_ids):
+    # One or two walls and up to two of the objects, some of them conflicting
+    room_layout_elements = [(rnd.choice(WALLS), rnd.choice(["on", "in the corner"])) for _ in range(rnd.randint(1, 2))]
+    objects_in_room = [(rnd.choice(object_ids), rnd.choice(OBJECT_PREPOSITIONS), rnd.random() < 0.6) for _ in range(rnd.randint(0, 2)) if object_ids]
+    return room_layout_elements, objects_in_room
+
+def build_random_scene(rnd, n):
+    """
+    Objects on the walls, in the middle of the room or next to them, with some conflicting constraints
+    """
+    objs = []
+    for i in range(n):
+        room_layout_elements, objects_in_room = [], []
+        facing = rnd.choice(WALLS)
+        if i < 4 or rnd.random() < 0.4:
+            room_layout_elements.append((rnd.choice(WALLS), "on"))
+        elif rnd.random() < 0.3:
+            room_layout_elements.append(("middle of the room", "on"))
+        else:
+            parent = rnd.choice([o for o in objs if o["placement"]["room_layout_elements"]])
+            objects_in_room.append((parent["new_object_id"], rnd.choice(OBJECT_PREPOSITIONS), rnd.random() < 0.5))
+            facing = parent["new_object_id"]
+        if rnd.random() < 0.3:
+            room_layout_elements.append((rnd.choice(WALLS), rnd.choice(["on", "in the corner"])))
+        if rnd.random() < 0.3 and i > 0:
+            objects_in_room.append((rnd.choice(objs)["new_object_id"], rnd.choice(OBJECT_PREPOSITIONS), rnd.random() < 0.6))
+        size = (round(rnd.uniform(0.2, 0.7), 2), round(rnd.uniform(0.2, 0.6), 2), round(rnd.uniform(0.3, 1.0), 2))
+        objs.append(build_object(f"obj_{i}", room_layout_elements, objects_in_room, size, facing=facing))
+    return objs
+
+@pytest.fixture
+def make_object():
+    return build_object
+
+@pytest.fixture
+def random_constraints():
+    return get_random_constraints
+
+@pytest.fixture
+def random_scene():
+    return build_random_scene
+
+@pytest.fixture
+def chain_scene():
+    # A chain table_1 -> shelf_1 -> box_1, the lamp is placed relative to the table and to the box
+    return [build_object("table_1", [("south_wall", "on")], is_on_the_floor=False),
+            build_object("shelf_1", objects_in_room=[("table_1", "on")], is_on_the_floor=False),
+            build_object("box_1", objects_in_room=[("shelf_1", "on")], is_on_the_floor=False),
+            build_object("lamp_1", [("north_wall", "on")], [("table_1", "right of"), ("box_1", "left of")], is_on_the_floor=False)]
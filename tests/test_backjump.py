@@ -0,0 +1,84 @@
+from utils import get_backjump, get_conflict_culprits, get_depth, get_no_overlap_reason
+
+def get_errors(obj, positions, cluster_constraint=None):
+    return get_no_overlap_reason(obj, positions, cluster_constraint, errors={})
+
+def test_conflict_culprits(chain_scene):
+    lamp = chain_scene[3]
+    # The wall and the table don't overlap, the box is within both
+    positions = [(0.0, 4.0, 3.5, 4.0, 0.0, 2.5), (0.0, 1.0, 0.0, 1.0, 0.0, 2.5), (0.0, 4.0, 0.0, 4.0, 0.0, 2.5)]
+    errors = get_errors(lamp, positions)
+    assert list(errors.keys()) == [("no_overlap", "lamp_1", "north_wall", "on", "table_1", "right of")]
+    assert get_conflict_culprits(errors) == {"table_1"}
+
+    # Against the cluster, the key ends with "cluster"
+    errors = get_errors(lamp, [positions[0], positions[2], positions[2]], cluster_constraint=(3.0, 4.0, 0.0, 1.0, 0.0, 0.1))
+    assert list(errors.keys()) == [("no_overlap", "lamp_1", "north_wall", "on", "cluster")]
+    assert get_conflict_culprits(errors) == set()
+
+def test_backjump_skips_levels(chain_scene):
+    scene = chain_scene
+    depths = get_depth(scene)
+    assert depths["table_1"] == 1 and depths["box_1"] == 3
+
+    errors = get_errors(scene[3], [(0.0, 4.0, 0.0, 4.0, 0.0, 2.5), (0.0, 1.0, 0.0, 1.0, 0.0, 2.5), (3.0, 4.0, 3.0, 4.0, 0.0, 2.5)])
+    assert get_conflict_culprits(errors) == {"table_1", "box_1"}
+    # The deepest culprit is on the current level, the search stays there and only moves it
+    assert get_backjump(errors, depths, 3) == (["box_1"], 3)
+    # Once the box is fixed, the search jumps from level 3 back to the table on level 1
+    assert get_backjump(errors, depths, 3, fixed={"box_1"}) == (["table_1"], 1)
+
+def test_backjump_falls_back_to_backtracking(chain_scene):
+    scene = chain_scene
+    depths = get_depth(scene)
+    errors = get_errors(scene[3], [(0.0, 4.0, 0.0, 4.0, 0.0, 2.5), (0.0, 1.0, 0.0, 1.0, 0.0, 2.5), (3.0, 4.0, 3.0, 4.0, 0.0, 2.5)])
+    # The culprits deeper than the current level aren't placed yet and the fixed ones can't move
+    assert get_backjump(errors, depths, 2, fixed={"table_1"}) == ([], None)
+    assert get_backjump({}, depths, 3) == ([], None)
+
+def test_backtrack_jumps_back_to_the_culprit(monkeypatch, chain_scene):
+    import IDesign
+    from utils import get_room_priors
+
+    # The first placement of the box fails because of the table, two levels up, the shelf in between is skipped
+    calls = []
+    def place_object(obj, *args, **kwargs):
+        calls.append(obj["new_object_id"])
+        if calls == ["table_1", "shelf_1", "box_1"]:
+            return {("no_overlap", "box_1", "south_wall", "on", "table_1", "right of") : 1}
+        obj["position"] = {"x" : 1.0, "y" : 1.0, "z" : 0.0}
+        return {}
+    monkeypatch.setattr(IDesign, "place_object", place_object)
+    monkeypatch.setattr(IDesign, "get_visualization", lambda *args : None)
+
+    i_design = IDesign.IDesign.__new__(IDesign.IDesign)
+    i_design.room_dimensions = [4.0, 4.0, 2.5]
+    i_design.room_priors = get_room_priors(i_design.room_dimensions)
+    i_design.scene_graph = {"objects_in_room" : chain_scene[:3]}
+    assert i_design.backtrack(backjumping=True, seed=0) == []
+    assert all("position" in obj for obj in i_design.scene_graph if obj["new_object_id"] in ("table_1", "shelf_1", "box_1"))
+    assert calls == ["table_1", "shelf_1", "box_1", "table_1", "shelf_1", "box_1"]
+
+def slow_first_backtrack(self, seed=None, **kwargs):
+    # Every seed finds a full solution, the first one last. The last seed only stops when it is told to
+    import time
+    import IDesign
+    if seed == 0:
+        time.sleep(0.5)
+    elif seed == 2:
+        IDesign._stop_event.wait(10)
+    self.scene_graph = [{"new_object_id" : f"seed_{seed}"}]
+    return []
+
+def test_restarts_return_the_first_full_solution(monkeypatch):
+    import multiprocessing
+    import pytest
+    import IDesign
+
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("The workers need the patched backtrack")
+    monkeypatch.setattr(IDesign.IDesign, "backtrack", slow_first_backtrack)
+    i_design = IDesign.IDesign.__new__(IDesign.IDesign)
+    # Seed 1 finishes first, the result is still the one of seed 0, and seed 2 is stopped
+    assert i_design.backtrack_with_restarts([0, 1, 2]) == []
+    assert i_design.seed == 0 and i_design.scene_graph == [{"new_object_id" : "seed_0"}]
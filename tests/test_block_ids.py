@@ -0,0 +1,21 @@
+from utils import get_block_object_ids, remap_block_object_ids
+
+def test_block_ids_are_kept():
+    counters = {}
+    block_ids = get_block_object_ids({"Object name" : "Desk chair", "Quantity" : 2}, counters)
+    objects = [{"new_object_id" : "desk_chair_2"}, {"new_object_id" : "desk_chair_1"}]
+    assert remap_block_object_ids(objects, block_ids, counters) == {}
+    assert [obj["new_object_id"] for obj in objects] == ["desk_chair_2", "desk_chair_1"]
+
+def test_other_ids_are_remapped_with_their_references(make_object):
+    counters = {}
+    get_block_object_ids({"Object name" : "desk", "Quantity" : 1}, counters)
+    block_ids = get_block_object_ids({"Object name" : "Desk chair", "Quantity" : 2}, counters)
+    objects = [make_object("chair_a", objects_in_room=[("desk_1", "in front")], facing="desk_1"),
+               make_object("chair_b", objects_in_room=[("chair_a", "left of")], facing="chair_a"),
+               make_object("chair_b", objects_in_room=[("chair_a", "right of")])]
+    # The third chair gets a new id after the ones of both blocks, the desk of the earlier block is left as it is
+    assert remap_block_object_ids(objects, block_ids, counters) == {"chair_a" : "desk_chair_1", "chair_b" : "desk_chair_2"}
+    assert [obj["new_object_id"] for obj in objects] == ["desk_chair_1", "desk_chair_2", "chair_b_1"]
+    assert objects[0]["facing"] == "desk_1" and objects[1]["facing"] == "desk_chair_1"
+    assert [obj["placement"]["objects_in_room"][0]["object_id"] for obj in objects] == ["desk_1", "desk_chair_1", "desk_chair_1"]
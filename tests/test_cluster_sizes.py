@@ -0,0 +1,35 @@
+import random
+import time
+
+import utils
+from scene import SceneGraph
+from utils import ROOM_LAYOUT_ELEMENTS, build_graph, get_cluster_size, get_cluster_sizes, preprocess_scene_graph
+
+def make_graph(random_scene, n):
+    scene_graph = SceneGraph(preprocess_scene_graph(random_scene(random.Random(n), n)))
+    return build_graph(scene_graph), scene_graph
+
+def test_cluster_sizes_match_single_objects(random_scene):
+    G, scene_graph = make_graph(random_scene, 60)
+    cluster_sizes = get_cluster_sizes(G, scene_graph)
+    assert cluster_sizes == {node : get_cluster_size(node, G, scene_graph) for node in G.nodes() if node not in ROOM_LAYOUT_ELEMENTS}
+
+def test_cluster_sizes_scale_linearly(random_scene, monkeypatch):
+    # The graph is analysed once for the whole pass
+    lookups = []
+    get_graph_analysis = utils.get_graph_analysis
+    monkeypatch.setattr(utils, "get_graph_analysis", lambda G : lookups.append(G) or get_graph_analysis(G))
+    G, scene_graph = make_graph(random_scene, 200)
+    get_cluster_sizes(G, scene_graph)
+    assert len(lookups) == 1
+
+    # O(V+E): 4 times the objects take about 4 times as long, far less than the 16 times of a quadratic pass
+    def get_time(n):
+        G, scene_graph = make_graph(random_scene, n)
+        times = []
+        for _ in range(5):
+            start_time = time.perf_counter()
+            get_cluster_sizes(G, scene_graph)
+            times.append(time.perf_counter() - start_time)
+        return min(times)
+    assert get_time(1600) < 8 * get_time(400)
@@ -0,0 +1,106 @@
+import random
+
+import networkx as nx
+import pytest
+
+from conflicts import ConflictTracker
+from scene import SceneGraph, invalidate_graph_analysis
+from utils import build_graph, get_cluster_sizes, get_conflicts, get_room_priors, get_size_conflicts, preprocess_scene_graph, remove_unnecessary_edges
+
+def edit_object(rnd, tracker, make_object, random_constraints):
+    # New placement and facing for a random object, without creating a cycle
+    obj = rnd.choice(list(tracker.scene_graph))
+    descendants = nx.descendants(tracker.G, obj["new_object_id"])
+    candidates = [x["new_object_id"] for x in tracker.scene_graph if x["new_object_id"] not in descendants and x is not obj]
+    obj["placement"] = make_object(obj["new_object_id"], *random_constraints(rnd, candidates))["placement"]
+    obj["facing"] = rnd.choice(["south_wall", "north_wall", "west_wall", "east_wall", "away"])
+    tracker.update(obj["new_object_id"])
+
+def remove_object(rnd, tracker):
+    # A random object with its descendants, like the deletion of the corrector
+    obj_id = rnd.choice(list(tracker.scene_graph))["new_object_id"]
+    tracker.remove(nx.descendants(build_graph(tracker.scene_graph), obj_id) | {obj_id})
+
+@pytest.mark.parametrize("seed", range(20))
+def test_tracker_matches_full_recompute(seed, make_object, random_constraints, random_scene):
+    rnd = random.Random(seed)
+    room_priors = get_room_priors([4.0, 4.0, 2.5])
+    scene_graph = SceneGraph(preprocess_scene_graph(random_scene(rnd, 30)))
+    tracker = ConflictTracker(remove_unnecessary_edges(build_graph(scene_graph)), scene_graph, "u", room_priors)
+    for step in range(12):
+        # Recomputed from scratch, without the cached analysis of the graph and the rotations of the tracker. A copy
+        # of the graph would list the predecessors in another order
+        G, scene_graph = tracker.G, SceneGraph(list(tracker.scene_graph))
+        invalidate_graph_analysis(G)
+        assert tracker.get_conflicts() == get_conflicts(G, scene_graph)
+        assert tracker.get_independent_conflicts() == ConflictTracker(G, scene_graph, "u", room_priors).get_independent_conflicts()
+        assert tracker.get_size_conflicts() == get_size_conflicts(G, scene_graph, "u", room_priors)
+        # The memoized clusters list their objects in the order a fresh computation does
+        cluster_sizes = get_cluster_sizes(G, scene_graph)
+        assert all(list(tracker.cluster_sizes[node][1]) == list(cluster_sizes[node][1]) for node in tracker.cluster_sizes)
+
+        if step % 4 == 3 and len(tracker.scene_graph) > 5:
+            remove_object(rnd, tracker)
+        else:
+            edit_object(rnd, tracker, make_object, random_constraints)
+
+def test_tracker_checks_only_the_affected_objects(monkeypatch, make_object, random_constraints, random_scene):
+    import conflicts
+
+    rnd = random.Random(0)
+    room_priors = get_room_priors([4.0, 4.0, 2.5])
+    scene_graph = SceneGraph(preprocess_scene_graph(random_scene(rnd, 100)))
+    tracker = ConflictTracker(remove_unnecessary_edges(build_graph(scene_graph)), scene_graph, "u", room_priors)
+
+    # Every call of the checkers with the number of nodes it checks
+    calls = []
+    def count(checker):
+        def counted(G, scene_graph, *args, nodes=None, **kwargs):
+            calls.append((checker.__name__, len(nodes)))
+            return checker(G, scene_graph, *args, nodes=nodes, **kwargs)
+        return counted
+    tracker.checkers = [count(checker) for checker in tracker.checkers]
+    monkeypatch.setattr(conflicts, "check_size_conflicts", count(conflicts.check_size_conflicts))
+
+    tracker.get_conflicts()
+    tracker.get_size_conflicts()
+    full = calls[:]
+    calls.clear()
+    edit_object(rnd, tracker, make_object, random_constraints)
+    tracker.get_conflicts()
+    tracker.get_size_conflicts()
+
+    # One call per checker in both cases, with fewer nodes after the edit
+    assert [name for name, _ in calls] == [name for name, _ in full] and len(calls) == len(ConflictTracker.checkers) + 1
+    assert all(n < n_full for (_, n), (_, n_full) in zip(calls, full))
+    assert sum(n for _, n in calls) < sum(n for _, n in full) / 2
+
+def test_tracker_recomputes_reordered_clusters(monkeypatch, make_object):
+    import utils
+
+    scene_graph = SceneGraph(preprocess_scene_graph([
+        make_object("table_1", [("south_wall", "on")]),
+        make_object("lamp_1", [("north_wall", "on")]),
+        make_object("shelf_1", [("west_wall", "on")]),
+        make_object("chair_1", objects_in_room=[("table_1", "left of"), ("shelf_1", "in front")]),
+        make_object("chair_2", objects_in_room=[("table_1", "right of"), ("lamp_1", "in front")])]))
+    tracker = ConflictTracker(remove_unnecessary_edges(build_graph(scene_graph)), scene_graph, "u", get_room_priors([4.0, 4.0, 2.5]))
+    tracker.get_size_conflicts()
+
+    # The clusters computed again, not taken from the memo
+    computed = []
+    get_cluster_size = utils.get_cluster_size
+    def counted(node, G, scene_graph, cluster_sizes=None, analysis=None):
+        if node not in cluster_sizes:
+            computed.append(node)
+        return get_cluster_size(node, G, scene_graph, cluster_sizes, analysis)
+    monkeypatch.setattr(utils, "get_cluster_size", counted)
+
+    # The lamp moves one level down, and the chair in front of it now comes after the other one in the topological
+    # order. The table is neither an ancestor nor a descendant of the lamp, its cluster still visits its chairs in
+    # the new order
+    lamp = tracker.scene_graph.get("lamp_1")
+    lamp["placement"] = make_object("lamp_1", objects_in_room=[("shelf_1", "left of")])["placement"]
+    tracker.update("lamp_1")
+    tracker.get_size_conflicts()
+    assert "table_1" in computed and "chair_1" not in computed
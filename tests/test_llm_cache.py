@@ -0,0 +1,49 @@
+from llm_cache import ResponseCache
+
+def get_totals(cache):
+    return tuple(cache.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone())
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_entries=10, max_size=10 ** 6, max_age=None, eviction_batch=4)
+    for i in range(10):
+        cache.set(f"key_{i}", {"content" : "x" * i})
+    # key_0 and key_1 become the most recently used
+    cache.get("key_0")
+    cache.get("key_1")
+    for i in range(10, 17):
+        cache.set(f"key_{i}", {"content" : "x" * i})
+    assert cache.get("key_0") is not None and cache.get("key_1") is not None
+    assert all(cache.get(f"key_{i}") is None for i in range(2, 9))
+    assert cache.evictions == 7
+    assert (cache.stats()["entries"], cache.stats()["size"]) == get_totals(cache) == (10, cache.size)
+
+def test_running_totals_follow_size_limit_and_replacements(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(path, max_entries=1000, max_size=200, max_age=None, eviction_batch=3)
+    for i in range(20):
+        cache.set(f"key_{i % 15}", {"content" : "x" * (i % 7)})
+        assert (cache.count, cache.size) == get_totals(cache)
+        assert cache.size <= 200
+    # The totals of an existing file are read back
+    assert (ResponseCache(path).count, ResponseCache(path).size) == get_totals(cache)
+    cache.clear()
+    assert (cache.count, cache.size) == get_totals(cache) == (0, 0)
+
+def test_recording_skips_the_cached_replies(tmp_path, monkeypatch):
+    import llm_backend
+    import llm_cache
+
+    # The cache already has the reply, the recording backend still gets the request for its transcript
+    requests = []
+    monkeypatch.setattr(llm_cache, "get_request_key", lambda recipient, messages : "key")
+    monkeypatch.setattr(llm_backend.RecordingBackend, "generate", lambda self, recipient, messages, sender=None, config=None : requests.append(messages) or (True, "recorded"))
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_age=None)
+    cache.set("key", "cached")
+    monkeypatch.setattr(llm_cache, "_response_cache", cache)
+    monkeypatch.setattr(llm_cache, "_response_cache_set", True)
+
+    monkeypatch.setattr(llm_backend, "_backend", llm_backend.OpenAIBackend())
+    assert llm_cache.cached_oai_reply(None, messages=[{"content" : "m"}]) == (True, "cached")
+    monkeypatch.setattr(llm_backend, "_backend", llm_backend.RecordingBackend(str(tmp_path / "transcript.jsonl")))
+    assert llm_cache.cached_oai_reply(None, messages=[{"content" : "m"}]) == (True, "recorded")
+    assert requests == [[{"content" : "m"}]]
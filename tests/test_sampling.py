@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from collision import CollisionEngine
+from utils import sample_candidates
+
+@pytest.fixture
+def box(make_object):
+    return make_object("box_1", size=(0.2, 0.2, 0.2), rotation={"z_angle" : 0.0})
+
+@pytest.mark.parametrize("sampling", ["random", "batch", "free_space"])
+def test_inverted_overlap_within_tolerance(box, sampling):
+    # calculate_overlap accepts boxes up to 1e-3 apart, the min of an axis can then be slightly above its max
+    overlap = (1.0005, 1.0, 0.5, 2.0, 0.1, 0.1)
+    candidates = sample_candidates(box, overlap, CollisionEngine(room_dimensions=[4.0, 4.0, 2.5]), np.random.default_rng(0), sampling)
+    position = next(candidates)
+    assert 1.0 <= position["x"] <= 1.0005
+    assert 0.5 <= position["y"] <= 2.0
+    assert position["z"] == pytest.approx(0.1)
+
+def test_inverted_point_overlap(box):
+    overlap = (1.0005, 1.0, 2.0005, 2.0, 0.1, 0.1)
+    position = next(sample_candidates(box, overlap, CollisionEngine(), np.random.default_rng(0)))
+    assert 1.0 <= position["x"] <= 1.0005
+    assert 2.0 <= position["y"] <= 2.0005
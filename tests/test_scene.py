@@ -0,0 +1,23 @@
+import networkx as nx
+
+from scene import get_graph_analysis, invalidate_graph_analysis
+
+def test_graph_analysis_is_cached_until_invalidated():
+    G = nx.DiGraph([("south_wall", "sofa_1"), ("sofa_1", "table_1"), ("table_1", "lamp_1")])
+    assert get_graph_analysis(G).get_order(["lamp_1", "sofa_1", "table_1"]) == ["sofa_1", "table_1", "lamp_1"]
+    assert get_graph_analysis(G) is get_graph_analysis(G)
+
+    # Same number of nodes and edges, the lamp now constrains the table. The code editing the graph invalidates it
+    G.remove_edge("table_1", "lamp_1")
+    G.add_edge("lamp_1", "table_1")
+    invalidate_graph_analysis(G)
+    analysis = get_graph_analysis(G)
+    assert analysis.order == list(nx.topological_sort(G))
+    assert analysis.rank["lamp_1"] < analysis.rank["table_1"]
+    assert analysis.predecessors["table_1"] == ["sofa_1", "lamp_1"]
+
+def test_graph_analysis_follows_added_nodes():
+    G = nx.DiGraph([("south_wall", "sofa_1")])
+    get_graph_analysis(G)
+    G.add_edge("sofa_1", "table_1")
+    assert get_graph_analysis(G).order == ["south_wall", "sofa_1", "table_1"]
@@ -1,13 +1,17 @@
 import networkx as nx
-from matplotlib import pyplot as plt
 import numpy as np
-import cv2
 from copy import copy, deepcopy
-import random
+import time
+import re
 
+from collision import CollisionEngine, is_thin_object
+from scene import CompiledScene, SceneGraph, get_graph_analysis, get_own_rotation, invalidate_graph_analysis
 from constraint_functions import get_above_constraint, get_behind_constraint, get_in_corner_constraint, get_in_front_constraint, get_left_of_constraint, get_right_of_constraint, get_on_constraint, get_under_contraint
 
 ROOM_LAYOUT_ELEMENTS = ["south_wall", "north_wall", "west_wall", "east_wall", "ceiling", "middle of the room"]
+# Repeated in every size conflict, prompts.compact_size_conflicts splits the conflicts on them
+DELETE_INSTRUCTION = "\nDelete one of these nodes depending on which one is the least important for the user preference and the room's functionality: "
+USER_PREFERENCE = "\nUser preference: "
 
 def get_room_priors(room_dimensions):
     x_mid = room_dimensions[0] / 2
@@ -29,14 +33,62 @@ def extract_list_from_json(input_json):
     for value in input_json.values(): 
         if isinstance(value, list):
             return value
-        
-def is_thin_object(obj):
+
+def get_block_object_ids(block, counters):
     """
-    Returns True if the object is thin
+    Ids for the instances of the object suggested in a designer block (ex. chair_1, chair_2),
+    counters keeps the last index used for each object name
     """
-    size = obj["size_in_meters"]
-    return min(size.values()) > 0.0 and max(size.values()) / min(size.values()) >= 40.0
-
+    name = next((v for k, v in block.items() if "name" in k.lower() and isinstance(v, str)), None)
+    if name is None:
+        return []
+    quantity = next((v for k, v in block.items() if "quantity" in k.lower()), 1)
+    try:
+        quantity = max(1, int(quantity))
+    except (TypeError, ValueError):
+        quantity = 1
+    base = re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+    ids = []
+    for _ in range(quantity):
+        counters[base] = counters.get(base, 0) + 1
+        ids.append(f"{base}_{counters[base]}")
+    return ids
+
+def remap_block_object_ids(objects, block_ids, counters):
+    """
+    Gives the objects of a block the ids assigned to it by get_block_object_ids, when the engineer used others.
+    The unknown or repeated ids take the unused ids of the block in order, then new ones from counters, and the
+    references to them within the block are renamed too. Returns the renamed ids
+    """
+    returned = [obj.get("new_object_id") for obj in objects]
+    unused = [obj_id for obj_id in block_ids if obj_id not in returned]
+    renamed, seen = {}, set()
+    for obj in objects:
+        obj_id = obj.get("new_object_id")
+        if obj_id in block_ids and obj_id not in seen:
+            seen.add(obj_id)
+            continue
+        if unused:
+            new_id = unused.pop(0)
+        else:
+            base = re.sub(r"_\d+$", "", re.sub(r"[^a-z0-9]+", "_", str(obj_id).lower()).strip("_")) or "object"
+            counters[base] = counters.get(base, 0) + 1
+            new_id = f"{base}_{counters[base]}"
+        if obj_id not in block_ids:
+            # The references to a repeated id of the block stay with its first object
+            renamed.setdefault(obj_id, new_id)
+        obj["new_object_id"] = new_id
+        seen.add(new_id)
+
+    if renamed:
+        for obj in objects:
+            if obj.get("facing") in renamed:
+                obj["facing"] = renamed[obj["facing"]]
+            for constraint in obj.get("placement", {}).get("objects_in_room", []):
+                if constraint.get("object_id") in renamed:
+                    constraint["object_id"] = renamed[constraint["object_id"]]
+    return renamed
+        
 def is_point_bbox(position):
     """
     Returns whether the plausible bounding box is a point
@@ -45,27 +97,15 @@ def is_point_bbox(position):
 
 def get_rotation(obj_A, scene_graph):
     # Get the rotation of an object in the scene graph
-    layout_rot = {
-        "west_wall" : 270.0,
-        "east_wall" : 90.0,
-        "north_wall" : 0.0,
-        "south_wall" : 180.0,
-        "middle of the room" : 0.0,
-        "ceiling" : 0.0
-    }
+    if isinstance(scene_graph, SceneGraph) and scene_graph.get(obj_A["new_object_id"]) is obj_A:
+        return scene_graph.get_rotation(obj_A)
 
-    if "rotation" in obj_A.keys():
-        rot = obj_A["rotation"]["z_angle"]
-    elif "facing" in obj_A.keys() and obj_A["facing"] in layout_rot.keys():
-        rot = layout_rot[obj_A["facing"]]
-    elif obj_A["new_object_id"] in layout_rot.keys():
-        rot = layout_rot[obj_A["new_object_id"]]
-    else: 
+    rot = get_own_rotation(obj_A)
+    if rot is None:
         parents = []
         for x in obj_A["placement"]["objects_in_room"]:
-            try:
-                p = [element for element in scene_graph if element.get("new_object_id") == x["object_id"]][0]
-            except:
+            p = get_object_from_scene_graph(x["object_id"], scene_graph)
+            if p is None:
                 print(f"Object {x['object_id']} not found in scene graph!")
                 raise ValueError("Object not found in scene graph!")
             parents.append(p)
@@ -108,7 +148,7 @@ def preprocess_scene_graph(scene_graph):
                 # Delete that relationship
                 obj["placement"]["objects_in_room"] = [x for x in obj["placement"]["objects_in_room"] if x["object_id"] != "middle of the room"]
                 continue
-            if elem["object_id"] not in [x["new_object_id"] for x in scene_graph]:
+            if get_object_from_scene_graph(elem["object_id"], scene_graph) is None:
                 closest_id = next(iter([x["new_object_id"] for x in scene_graph if elem["object_id"] in x["new_object_id"]]), None)
                 if closest_id is not None:
                     elem["object_id"] = closest_id
@@ -121,27 +161,44 @@ def build_graph(scene_graph):
     G = nx.DiGraph()
     # Create graph
     for obj in scene_graph:
-        if obj["new_object_id"] not in G.nodes():
-            G.add_node(obj["new_object_id"])
-        obj_scene_graph = obj["placement"]
-        for constraint in obj_scene_graph["room_layout_elements"]:
-            if constraint["layout_element_id"] not in G.nodes():
-                G.add_node(constraint["layout_element_id"])
-            G.add_edge(constraint["layout_element_id"], obj["new_object_id"], weight={"preposition" : constraint["preposition"], "adjacency" : True})
-        for constraint in obj_scene_graph["objects_in_room"]:
-            if constraint["object_id"] not in G.nodes():
-                G.add_node(constraint["object_id"])
-            G.add_edge(constraint["object_id"], obj["new_object_id"], weight={"preposition" : constraint["preposition"], "adjacency" : constraint["is_adjacent"]})
+        add_object_edges(G, obj)
     return G
 
-def find_room_layout_conflicts(G, scene_graph):
+def add_object_edges(G, obj):
+    # Add the object and the edges of its placement constraints to the graph
+    if obj["new_object_id"] not in G.nodes():
+        G.add_node(obj["new_object_id"])
+    obj_scene_graph = obj["placement"]
+    for constraint in obj_scene_graph["room_layout_elements"]:
+        if constraint["layout_element_id"] not in G.nodes():
+            G.add_node(constraint["layout_element_id"])
+        G.add_edge(constraint["layout_element_id"], obj["new_object_id"], weight={"preposition" : constraint["preposition"], "adjacency" : True})
+    for constraint in obj_scene_graph["objects_in_room"]:
+        if constraint["object_id"] not in G.nodes():
+            G.add_node(constraint["object_id"])
+        G.add_edge(constraint["object_id"], obj["new_object_id"], weight={"preposition" : constraint["preposition"], "adjacency" : constraint["is_adjacent"]})
+
+def find_room_layout_conflicts(G, scene_graph, nodes=None, with_nodes=False):
+    # Only the conflicts of the given nodes (all of them by default) are reported, as (conflict, node) pairs with with_nodes
     conflicts = []
-
-    topological_order = list(nx.topological_sort(G))
+    analysis = get_graph_analysis(G)
+    if nodes is not None:
+        # The layouts of the nodes only depend on their ancestors, found in one pass for all the nodes
+        nodes = set(nodes)
+        ancestors = {node for node in nodes if node in G}
+        stack = list(ancestors)
+        while stack:
+            for p in analysis.predecessors[stack.pop()]:
+                if p not in ancestors:
+                    ancestors.add(p)
+                    stack.append(p)
+        order = analysis.get_order(ancestors)
+    else:
+        order = analysis.order
     node_layout = dict(G.nodes(data=True))
-    for node in topological_order:
+    for node in order:
         if node not in ROOM_LAYOUT_ELEMENTS:
-            parents = list(G.predecessors(node))
+            parents = analysis.predecessors[node]
             parents_room_layout = [node_layout[p] for p in parents]
             different_parent_room_layout = False
             for p in parents_room_layout[1:]:
@@ -163,9 +220,10 @@ def find_room_layout_conflicts(G, scene_graph):
             if len(parents_room_layout) > 0 and different_parent_room_layout:
                 # This should be a spatial conflict, if the relationship isn't 'corner'
                 if not all([G[p][node]["weight"]["preposition"] == "in the corner" for p in parents]) and not any([p == "ceiling" for p in parents]):
-                    conflict_string = f"The object {node} cannot have the parents {parents} at the same time! Eliminate one."
-                    conflict_string += "\nObject to reposition: " + str(get_object_from_scene_graph(node, scene_graph))
-                    conflicts.append(conflict_string)
+                    if nodes is None or node in nodes:
+                        conflict_string = f"The object {node} cannot have the parents {parents} at the same time! Eliminate one."
+                        conflict_string += "\nObject to reposition: " + str(get_object_from_scene_graph(node, scene_graph))
+                        conflicts.append((conflict_string, node) if with_nodes else conflict_string)
                 else:
                     # node_layout[node] = parents_room_layout
                     node_layout[node] = {}
@@ -180,8 +238,7 @@ def remove_unnecessary_edges(G):
     """
     Remove non-corner relationships if the object has a corner relationship
     """
-    topological_order = list(nx.topological_sort(G))
-    for node in topological_order:
+    for node in get_graph_analysis(G).order:
         if node not in ROOM_LAYOUT_ELEMENTS:
             parents = list(G.predecessors(node))
             if any([G[p][node]["weight"]["preposition"] == "in the corner" for p in parents]):
@@ -191,6 +248,7 @@ def remove_unnecessary_edges(G):
                         if G[p][node]["weight"]["preposition"] != "in the corner":
                             print(f"Removing edge {p} -> {node} with preposition {G[p][node]['weight']['preposition']}")
                             G.remove_edge(p, node)
+    invalidate_graph_analysis(G)
     return G
 
 def handle_under_prepositions(G, scene_graph):
@@ -214,61 +272,63 @@ def handle_under_prepositions(G, scene_graph):
         scene_graph = [x for x in scene_graph if x["new_object_id"] != node]
         if node in G.nodes():
             G.remove_node(node)
+    invalidate_graph_analysis(G)
     return G, scene_graph
 
-def check_corner_relationships(G, scene_graph):
-    def find_corner_vacancy():
-        # Find the corner that is not occupied
-        corners = [("south_wall", "west_wall"), ("south_wall", "east_wall"), ("north_wall", "west_wall"), ("north_wall", "east_wall")]
-        occupied_corners = []
-        for wall_1, wall_2 in corners:
-            for node in topological_order:
-                if node not in ROOM_LAYOUT_ELEMENTS:
-                    parents = list(G.predecessors(node))
-                    if wall_1 in parents and wall_2 in parents:
-                        occupied_corners.append((wall_1, wall_2))
-        vacant_corners = list(set(corners) - set(occupied_corners))
-        return vacant_corners
-    
-    def find_corner_occupancy():
-        # Find whether corners are occupied by more than one object 
-        corners = [("south_wall", "west_wall"), ("south_wall", "east_wall"), ("north_wall", "west_wall"), ("north_wall", "east_wall")]
-        occupied_corners = {k : [] for k in corners}
-        for wall_1, wall_2 in corners:
-            for node in topological_order:
-                if node not in ROOM_LAYOUT_ELEMENTS:
-                    parents = list(G.predecessors(node))
-                    if wall_1 in parents and wall_2 in parents:
-                        occupied_corners[(wall_1, wall_2)].append(node)
-        return occupied_corners
-
-    topological_order = list(nx.topological_sort(G))
-    conflicts = []
+CORNERS = [("south_wall", "west_wall"), ("south_wall", "east_wall"), ("north_wall", "west_wall"), ("north_wall", "east_wall")]
 
-    corner_occupancy = find_corner_occupancy()
+def find_corner_occupancy(G):
+    # Find the objects occupying each corner
+    analysis = get_graph_analysis(G)
+    occupied_corners = {k : [] for k in CORNERS}
+    for wall_1, wall_2 in CORNERS:
+        for node in analysis.order:
+            if node not in ROOM_LAYOUT_ELEMENTS:
+                parents = analysis.predecessors[node]
+                if wall_1 in parents and wall_2 in parents:
+                    occupied_corners[(wall_1, wall_2)].append(node)
+    return occupied_corners
+
+def find_corner_vacancy(G):
+    # Find the corners that are not occupied
+    occupied_corners = [k for k, v in find_corner_occupancy(G).items() if len(v) > 0]
+    vacant_corners = list(set(CORNERS) - set(occupied_corners))
+    return vacant_corners
+
+def check_corner_occupancy(G, scene_graph):
+    # Find whether corners are occupied by more than one object 
+    conflicts = []
+    corner_occupancy = find_corner_occupancy(G)
     for key, value in corner_occupancy.items():
         if len(value) > 1:
             conflict_string = f"The corner {key[0].split('_')[0]}-{key[1].split('_')[0]} is occupied by more than one object: {value}. Move one of them to another vacant corner."
-            conflict_string += "\nVacant corners: " + str(find_corner_vacancy())
+            conflict_string += "\nVacant corners: " + str(find_corner_vacancy(G))
             conflicts.append(conflict_string)
-        
+    return conflicts
+
+def check_corner_relationships(G, scene_graph, nodes=None, with_nodes=False):
+    analysis = get_graph_analysis(G)
+    # The occupancy concerns the whole room, it is only checked when all the nodes are (with the node None)
+    conflicts = check_corner_occupancy(G, scene_graph) if nodes is None else []
+    if with_nodes:
+        conflicts = [(conflict, None) for conflict in conflicts]
 
     # Check whether objects with "corner" relationships have two corresponding walls
-    for node in topological_order:
+    for node in analysis.get_order(nodes):
         if node not in ROOM_LAYOUT_ELEMENTS:
-            parents = list(G.predecessors(node))
+            parents = analysis.predecessors[node]
             if any([G[p][node]["weight"]["preposition"] == "in the corner" for p in parents]):
                 if len(parents) == 1:
-                    vacant_corners = find_corner_vacancy()
+                    vacant_corners = find_corner_vacancy(G)
                     vacant_corners = [f"{c[0].split('_')[0]}-{c[1].split('_')[0]} corner" for c in vacant_corners]
                     conflict_string = f"Corner relationship for {node} has {len(parents)} parent, add another wall to the relationship. \n Current vacant corners: {vacant_corners}"
                     conflict_string += "\nObject to reposition: " + str(get_object_from_scene_graph(node, scene_graph))
-                    conflicts.append(conflict_string)
+                    conflicts.append((conflict_string, node) if with_nodes else conflict_string)
     return conflicts
 
 directional_preps = ["in front", "left of", "behind", "right of"]
 
-def check_corner_relationship_impossibilities(G, scene_graph):
+def check_corner_relationship_impossibilities(G, scene_graph, nodes=None, with_nodes=False):
     conflicts = []
     # Check for impossible relationships in corners
     wall_impossible_preps = {
@@ -278,15 +338,15 @@ def check_corner_relationship_impossibilities(G, scene_graph):
         "east_wall" : "right of"
     }
 
-    topological_order = list(nx.topological_sort(G))
-    for node in topological_order:
+    analysis = get_graph_analysis(G)
+    for node in analysis.get_order(nodes):
         if node not in ROOM_LAYOUT_ELEMENTS:
-            parents_raw = list(G.predecessors(node))
+            parents_raw = analysis.predecessors[node]
             parents = list(filter(lambda x : x not in ROOM_LAYOUT_ELEMENTS, parents_raw))
-            parents_rot = [get_rotation(next((x for x in scene_graph if x["new_object_id"] == p), None), scene_graph) for p in parents]
+            parents_rot = [get_rotation(get_object_from_scene_graph(p, scene_graph), scene_graph) for p in parents]
             # Check whether the parent object is in the corner and if this object is located spatially correctly
             for p, r in zip(parents, parents_rot):
-                p_parent = list(G.predecessors(p))
+                p_parent = analysis.predecessors[p]
                 corners = [p_p for p_p in p_parent if G[p_p][p]["weight"]["preposition"] == "in the corner"]
                 impossible_preps = []
                 if len(corners) != 2:
@@ -311,10 +371,10 @@ def check_corner_relationship_impossibilities(G, scene_graph):
                     conflict_string += f"The object {p} is on the {corner_name}. "
                     conflict_string += " ".join([f"{p} has the object {edge[1]} {edge[2]['weight']['preposition']} it. " for edge in G.out_edges(p, data=True) if edge[1] != node and edge[2]["weight"]["adjacency"]])
                     conflict_string += "\n Object to reposition: " + str(get_object_from_scene_graph(node, scene_graph))
-                    conflicts.append(conflict_string)
+                    conflicts.append((conflict_string, node) if with_nodes else conflict_string)
     return conflicts
 
-def check_wall_relationship_impossibilities(G, scene_graph):
+def check_wall_relationship_impossibilities(G, scene_graph, nodes=None, with_nodes=False):
     conflicts = []
     # Check for impossible relationships in corners
     wall_impossible_preps = {
@@ -324,15 +384,15 @@ def check_wall_relationship_impossibilities(G, scene_graph):
         "east_wall" : "right of"
     }
 
-    topological_order = list(nx.topological_sort(G))
-    for node in topological_order:
+    analysis = get_graph_analysis(G)
+    for node in analysis.get_order(nodes):
         if node not in ROOM_LAYOUT_ELEMENTS:
-            parents_raw = list(G.predecessors(node))
+            parents_raw = analysis.predecessors[node]
             parents = list(filter(lambda x : x not in ROOM_LAYOUT_ELEMENTS, parents_raw))
-            parents_rot = [get_rotation(next((x for x in scene_graph if x["new_object_id"] == p), None), scene_graph) for p in parents]
+            parents_rot = [get_rotation(get_object_from_scene_graph(p, scene_graph), scene_graph) for p in parents]
             # Check whether the parent object is in the corner and if this object is located spatially correctly
             for p, r in zip(parents, parents_rot): 
-                p_parent_raw = list(G.predecessors(p))
+                p_parent_raw = analysis.predecessors[p]
                 p_parent = list(filter(lambda x : x in wall_impossible_preps.keys(), p_parent_raw))
                 walls = [p_p for p_p in p_parent if G[p_p][p]["weight"]["preposition"] == "on"]
                 for p_p in walls:
@@ -350,20 +410,20 @@ def check_wall_relationship_impossibilities(G, scene_graph):
                         conflict_string += f"The object {p} is on the {p_p}. "
                         conflict_string += " ".join([f"{p} has the object {edge[1]} {edge[2]['weight']['preposition']} it. " for edge in G.out_edges(p, data=True) if edge[1] != node and edge[2]["weight"]["adjacency"]])
                         conflict_string += "\n Object to reposition: " + str(get_object_from_scene_graph(node, scene_graph))
-                        conflicts.append(conflict_string)
+                        conflicts.append((conflict_string, node) if with_nodes else conflict_string)
     return conflicts
 
 
-def check_impossible_relationships(G, scene_graph):
+def check_impossible_relationships(G, scene_graph, nodes=None, with_nodes=False):
     conflicts = []
-    topological_order = list(nx.topological_sort(G))
+    analysis = get_graph_analysis(G)
     # Check for impossible relationships between objects
-    for node in topological_order:
+    for node in analysis.get_order(nodes):
         if node not in ROOM_LAYOUT_ELEMENTS:
-            parents_raw = list(G.predecessors(node))
+            parents_raw = analysis.predecessors[node]
             parents = list(filter(lambda x : x not in ROOM_LAYOUT_ELEMENTS, parents_raw))
             children = list(G.successors(node))
-            node_rot = get_rotation(next((x for x in scene_graph if x["new_object_id"] == node), None), scene_graph) 
+            node_rot = get_rotation(get_object_from_scene_graph(node, scene_graph), scene_graph) 
             # Adjacent child exclusivity
             for p in parents:
                 prep = G[p][node]["weight"]["preposition"]
@@ -377,24 +437,27 @@ def check_impossible_relationships(G, scene_graph):
                             # print(f"Impossible relationship between {node} and {c} with rotation {node_rot} and relationship {G[node][c]['weight']['preposition']}")
                             conflict_string = f"The object {c} cannot be {G[node][c]['weight']['preposition']} of the object {node} since the {p} object is there. Find another relationship for {c} with {node}!"
                             conflict_string += "\n Object to reposition: " + str(get_object_from_scene_graph(c, scene_graph))
-                            conflicts.append(conflict_string)
+                            conflicts.append((conflict_string, node) if with_nodes else conflict_string)
     return conflicts
 
-def get_cluster_size(node, G, scene_graph): 
-    # Get the size of the cluster of objects
+def get_cluster_size(node, G, scene_graph, cluster_sizes=None, analysis=None): 
+    # Get the size of the cluster of objects, the results of the subtrees are memoized in cluster_sizes.
+    # analysis is the graph analysis of G if the caller already has it
+    if cluster_sizes is None:
+        cluster_sizes = {}
+    if node in cluster_sizes:
+        return cluster_sizes[node]
+    if analysis is None:
+        analysis = get_graph_analysis(G)
     node_obj = get_object_from_scene_graph(node, scene_graph)
     try:
         node_obj_rot = get_rotation(node_obj, scene_graph)
     except:
         print(f"Node: {node}")
         raise ValueError("Error in getting the rotation of the object!")
-    # Get the outgoing edges
+    # Get the outgoing edges, in reversed topological order of the children
     outgoing_e = list(G.out_edges(node, data=True))
-    outgoing_nodes = [edge[1] for edge in outgoing_e]
-    # Get the topological order of the outgoing nodes
-    topological_order_reversed = list(reversed(list(nx.topological_sort(G))))
-    topological_outgoing_nodes = [node for node in topological_order_reversed if node in outgoing_nodes]
-    outgoing_e_sorted = sorted(outgoing_e, key=lambda x : topological_outgoing_nodes.index(x[1]))
+    outgoing_e_sorted = analysis.sort_edges(outgoing_e, reverse=True)
     size_constraint = {"left of" : 0.0, "right of" : 0.0, "behind" : 0.0, "in front" : 0.0}
     children_objs = set()
     if len(outgoing_e_sorted) != 0:
@@ -420,7 +483,7 @@ def get_cluster_size(node, G, scene_graph):
             size_constraint_value = edge_obj["size_in_meters"][size_constraint_key]
 
             # Retrieve the size of the cluster and the additional descendants of the child object
-            edge_cluster_size, edge_children = get_cluster_size(edge[1], G, scene_graph)
+            edge_cluster_size, edge_children = get_cluster_size(edge[1], G, scene_graph, cluster_sizes, analysis)
             children_objs = children_objs.union(edge_children)
 
             # Adjust the size constraint based on the preposition 
@@ -431,19 +494,34 @@ def get_cluster_size(node, G, scene_graph):
                     size_constraint[prep] = max(size_constraint[prep], value_to_add)
                 else:
                     size_constraint[prep] += value_to_add         
+    cluster_sizes[node] = (size_constraint, children_objs)
     return size_constraint, children_objs
 
-def check_size_conflicts(G, scene_graph, user_input, room_priors, verbose=False):
+def get_cluster_sizes(G, scene_graph, cluster_sizes=None):
+    """
+    Cluster sizes of all the objects in one bottom-up pass, the children are always computed before their parents
+    """
+    if cluster_sizes is None:
+        cluster_sizes = {}
+    analysis = get_graph_analysis(G)
+    for node in analysis.reversed_order:
+        if node not in ROOM_LAYOUT_ELEMENTS:
+            get_cluster_size(node, G, scene_graph, cluster_sizes, analysis)
+    return cluster_sizes
+
+def check_size_conflicts(G, scene_graph, user_input, room_priors, verbose=False, nodes=None, cluster_sizes=None, with_nodes=False):
+    # Only the given nodes are checked if nodes is set, cluster_sizes can carry memoized cluster sizes between calls.
+    # With with_nodes, the conflicts come as (conflict, node) pairs
     conflicts = []
-    topological_order_reversed = list(reversed(list(nx.topological_sort(G))))
+    analysis = get_graph_analysis(G)
+    if cluster_sizes is None:
+        cluster_sizes = {}
 
     if verbose:
-        for node in topological_order_reversed:
-            if node not in ROOM_LAYOUT_ELEMENTS:
-                clstr_size, children_objs = get_cluster_size(node, G, scene_graph)
+        get_cluster_sizes(G, scene_graph, cluster_sizes)
                 
     # Find cluster size conflicts
-    for node in topological_order_reversed:
+    for node in analysis.get_order(nodes, reverse=True):
         if node not in ROOM_LAYOUT_ELEMENTS:
             node_obj = get_object_from_scene_graph(node, scene_graph)
             node_obj_rot = get_rotation(node_obj, scene_graph)
@@ -480,25 +558,23 @@ def check_size_conflicts(G, scene_graph, user_input, room_priors, verbose=False)
                 if node_obj["size_in_meters"][constraint_key] < size_constraint[prep]:
                     conflict_str = f"The {constraint_key} of the object {node} is too small to accommodate the following object {prep} of it!"
                     nodes = [edge[1] for edge in outgoing_e if edge[2]["weight"]["preposition"] == prep]
-                    conflict_str += "\nDelete one of these nodes depending on which one is the least important for the user preference and the room's functionality: "                
+                    conflict_str += DELETE_INSTRUCTION
                     conflict_str += ", ".join(nodes)
-                    conflict_str += f"\nUser preference: {user_input}"
-                    conflicts.append(conflict_str)
+                    conflict_str += f"{USER_PREFERENCE}{user_input}"
+                    conflicts.append((conflict_str, node) if with_nodes else conflict_str)
             if node_obj["size_in_meters"]["length"] < size_constraint["on"][0] or node_obj["size_in_meters"]["width"] < size_constraint["on"][1]:
                 nodes = [edge[1] for edge in outgoing_e if edge[2]["weight"]["preposition"] == "on"]
                 conflict_str = f"The area of the {node} is too small to accommodate all of the following objects on it!"
-                conflict_str += "\nDelete one of these nodes depending on which one is the least important for the user preference and the room's functionality: "                
+                conflict_str += DELETE_INSTRUCTION
                 conflict_str += ", ".join(nodes)
-                conflict_str += f"\nUser preference: {user_input}"
-                conflicts.append(conflict_str)
+                conflict_str += f"{USER_PREFERENCE}{user_input}"
+                conflicts.append((conflict_str, node) if with_nodes else conflict_str)
                 
         if node in ROOM_LAYOUT_ELEMENTS:   
             node_obj = get_object_from_scene_graph(node, room_priors)
             node_obj_rot = get_rotation(node_obj, scene_graph)
             outgoing_e = list(G.out_edges(node, data=True))
-            outgoing_nodes = [edge[1] for edge in outgoing_e]
-            topological_outgoing_nodes = [node for node in topological_order_reversed if node in outgoing_nodes]
-            outgoing_e_sorted = sorted(outgoing_e, key=lambda x : topological_outgoing_nodes.index(x[1]))
+            outgoing_e_sorted = analysis.sort_edges(outgoing_e, reverse=True)
 
             outgoing_set = set()
             size_constraint = 0.0 if node != "middle of the room" else (0.0, 0.0)
@@ -509,7 +585,7 @@ def check_size_conflicts(G, scene_graph, user_input, room_priors, verbose=False)
                 if not edge_obj["is_on_the_floor"]:
                     continue
                 edge_obj_rot = get_rotation(edge_obj, scene_graph)
-                cluster_size, e_children = get_cluster_size(edge[1], G, scene_graph)
+                cluster_size, e_children = get_cluster_size(edge[1], G, scene_graph, cluster_sizes, analysis)
                 print(f"Cluster size for {edge[1]}: {cluster_size}")
                 rot_diff = abs(node_obj_rot - edge_obj_rot)
                 constraint_key = ("length", "width") if rot_diff % 180 == 0 else ("width", "length")
@@ -534,23 +610,23 @@ def check_size_conflicts(G, scene_graph, user_input, room_priors, verbose=False)
             if node != "middle of the room":
                 if node_obj["size_in_meters"]["length"] < size_constraint:
                     conflict_str = f"The length of the {node} is too small to accommodate all of the following objects on it: "
-                    conflict_str += "\nDelete one of these nodes depending on which one is the least important for the user preference and the room's functionality: "
+                    conflict_str += DELETE_INSTRUCTION
                     conflict_str += ", ".join(outgoing_set)
-                    conflict_str += f"\nUser preference: {user_input}"
-                    conflicts.append(conflict_str)
+                    conflict_str += f"{USER_PREFERENCE}{user_input}"
+                    conflicts.append((conflict_str, node) if with_nodes else conflict_str)
             else:
                 if node_obj["size_in_meters"]["length"] < size_constraint[0]:
                     conflict_str = f"The length of the {node} is too small to accommodate all of the following objects on it: "
-                    conflict_str += "\nDelete one of these nodes depending on which one is the least important for the user preference and the room's functionality: "
+                    conflict_str += DELETE_INSTRUCTION
                     conflict_str += ", ".join(outgoing_set)
-                    conflict_str += f"\nUser preference: {user_input}"
-                    conflicts.append(conflict_str)
+                    conflict_str += f"{USER_PREFERENCE}{user_input}"
+                    conflicts.append((conflict_str, node) if with_nodes else conflict_str)
                 if node_obj["size_in_meters"]["width"] < size_constraint[1]:
                     conflict_str = f"The width of the {node} is too small to accommodate all of the following objects on it: "
-                    conflict_str += "\nDelete one of these nodes depending on which one is the least important for the user preference and the room's functionality: "
+                    conflict_str += DELETE_INSTRUCTION
                     conflict_str += ", ".join(outgoing_set)
-                    conflict_str += f"\nUser preference: {user_input}"
-                    conflicts.append(conflict_str)
+                    conflict_str += f"{USER_PREFERENCE}{user_input}"
+                    conflicts.append((conflict_str, node) if with_nodes else conflict_str)
     return conflicts
 
 def get_cluster_objects(scene_graph):
@@ -578,6 +654,8 @@ def get_object_from_scene_graph(obj_id, scene_graph):
     """
     Get the object from the scene graph by its id
     """
+    if isinstance(scene_graph, SceneGraph):
+        return scene_graph.get(obj_id)
     return next((x for x in scene_graph if x["new_object_id"] == obj_id), None)
 
 def has_one_parent_and_one_child(tree):
@@ -731,6 +809,7 @@ def clean_and_extract_edges(relationships, parent_id, verbose):
         dag.remove_edge(cycles[0][-1], cycles[0][0])
 
     if verbose:
+        from matplotlib import pyplot as plt # Only needed for the plots
         plt.subplot(121)
         pos_original = nx.spring_layout(dag)
         nx.draw(dag, pos_original, with_labels=True, font_weight='bold', node_size=700, arrowsize=20)
@@ -744,6 +823,7 @@ def clean_and_extract_edges(relationships, parent_id, verbose):
     # binary_tree, flipped_edges = flip_edges_to_binary_tree(dag, list(dag.nodes())[0], verbose)
     binary_tree, flipped_edges = flip_edges(dag, list(dag.nodes())[0], verbose)
     if binary_tree and verbose:
+        from matplotlib import pyplot as plt
         # Visualize the original graph and the obtained binary tree
         pos_original = nx.spring_layout(dag)
         pos_binary_tree = nx.spring_layout(binary_tree)
@@ -761,6 +841,7 @@ def clean_and_extract_edges(relationships, parent_id, verbose):
     return binary_tree.edges(), flipped_edges
 
 def create_empty_image_with_boxes(image_size, boxes):
+    import cv2 # Only needed for the visualization
     img = np.zeros((image_size[0], image_size[1], 3), dtype=np.uint8)
 
     for box in boxes:
@@ -901,8 +982,13 @@ def get_depth(scene_graph):
     all_nodes_depth = {k: v for k, v in all_nodes_depth.items() if k not in prior_ids}
     return all_nodes_depth
 
-def get_possible_positions(object_id, scene_graph, room_dimensions):
-    obj = [element for element in scene_graph if element.get("new_object_id") == object_id][0]
+def get_possible_positions(object_id, scene_graph, room_dimensions, compiled_scene=None):
+    if compiled_scene is not None:
+        obj = compiled_scene.get(object_id)
+    elif isinstance(scene_graph, SceneGraph):
+        obj = scene_graph.get(object_id)
+    else:
+        obj = [element for element in scene_graph if element.get("new_object_id") == object_id][0]
     obj_scene_graph = obj["placement"]
     rot = get_rotation(obj, scene_graph)
     obj["rotation"] = {"z_angle" : rot}
@@ -927,7 +1013,12 @@ def get_possible_positions(object_id, scene_graph, room_dimensions):
         is_on_floor = obj["is_on_the_floor"]
         obj_A = obj
         key = "layout_element_id" if "layout_element_id" in constraint.keys() else "object_id"
-        obj_B = [element for element in scene_graph if element.get("new_object_id") == constraint[key]][0]
+        if compiled_scene is not None:
+            obj_B = compiled_scene.get(constraint[key])
+        elif isinstance(scene_graph, SceneGraph):
+            obj_B = scene_graph.get(constraint[key])
+        else:
+            obj_B = [element for element in scene_graph if element.get("new_object_id") == constraint[key]][0]
         if "position" in obj_B.keys():
             possible_positions.append(func_map[prep](obj_A, obj_B, adjacency, is_on_floor, room_dimensions))
 
@@ -985,12 +1076,77 @@ def get_no_overlap_reason(obj, positions, cluster_constraint=None, errors={}):
             errors[key] = 1 + errors.get(key, 0)
     return errors
 
-def place_object(obj, scene_graph, room_dimensions, errors={}, verbose=False):
+def get_conflict_culprits(errors):
+    """
+    Returns the ids of the objects that the no overlap errors point at
+    """
+    culprits = set()
+    for key in errors.keys():
+        if key[0] == "no_overlap":
+            culprits.update([k for k in key[2::2] if k != "cluster" and k not in ROOM_LAYOUT_ELEMENTS])
+    return culprits
+
+def get_backjump(errors, depths, depth, fixed=()):
+    """
+    Returns the depth to jump back to, the deepest of the culprits of the no overlap errors that can still be moved
+    (at most at the current depth and not fixed), and the culprits at that depth, the ones to place again.
+    ([], None) if there isn't any, the search then backtracks one level instead
+    """
+    culprits = [c for c in get_conflict_culprits(errors) if c in depths and depths[c] <= depth and c not in fixed]
+    if not culprits:
+        return [], None
+    jump_depth = max([depths[c] for c in culprits])
+    return sorted([c for c in culprits if depths[c] == jump_depth]), jump_depth
+
+def sample_candidates(obj, overlap, collision_engine, rng, sampling="random", batch_size=16):
+    """
+    Yields candidate positions for the object inside the overlap box.
+    "random" draws one point at a time, "batch" draws batch_size points at once, rejects the colliding ones in bulk
+    and yields the survivors ordered by their distance to the center of the box, "free_space" subtracts the occupied
+    footprints from the box and samples from the remaining free region, yielding nothing if there is none
+    """
+    # calculate_overlap accepts boxes up to its tolerance apart, so a min can be slightly above its max, which the
+    # generator's uniform doesn't allow
+    low, high = np.minimum(overlap[0::2], overlap[1::2]), np.maximum(overlap[0::2], overlap[1::2])
+    if is_point_bbox(overlap):
+        yield {"x" : rng.uniform(low[0], high[0]), "y" : rng.uniform(low[1], high[1]), "z" : rng.uniform(low[2], high[2])}
+        return
+    if sampling == "random":
+        while True:
+            yield {"x" : rng.uniform(low[0], high[0]), "y" : rng.uniform(low[1], high[1]), "z" : rng.uniform(low[2], high[2])}
+    elif sampling == "batch":
+        center = (low + high) / 2
+        for _ in range(50):
+            draws = rng.uniform(low, high, size=(batch_size, 3))
+            survivors = draws[~collision_engine.collisions(obj, draws)]
+            survivors = survivors[np.argsort(np.linalg.norm(survivors - center, axis=1))]
+            for x, y, z in survivors:
+                yield {"x" : float(x), "y" : float(y), "z" : float(z)}
+    elif sampling == "free_space":
+        regions_low, regions_high = collision_engine.free_regions(obj, overlap)
+        if len(regions_low) == 0:
+            return
+        volumes = np.prod(np.where(regions_high > regions_low, regions_high - regions_low, 1.0), axis=1)
+        while True:
+            i = rng.choice(len(volumes), p=volumes / volumes.sum())
+            x, y, z = rng.uniform(regions_low[i], regions_high[i])
+            yield {"x" : float(x), "y" : float(y), "z" : float(z)}
+    else:
+        raise ValueError(f"Unknown sampling mode: {sampling}")
+
+def place_object(obj, scene_graph, room_dimensions, errors={}, verbose=False, collision_engine=None, sampling="random", batch_size=16, deadline=None, stop_event=None, rng=None, compiled_scene=None):
+    if collision_engine is None:
+        collision_engine = CollisionEngine(scene_graph, room_dimensions)
+    if compiled_scene is None:
+        # Compiled once here and passed down to the children, instead of sorting the scene for every object
+        compiled_scene = CompiledScene(scene_graph)
+    if rng is None:
+        rng = np.random.default_rng()
     if verbose:
         get_visualization(scene_graph)
-    if not any(d.get("new_object_id") == obj["new_object_id"] for d in scene_graph):
+    if obj["new_object_id"] not in compiled_scene.index:
         return errors
-    positions = get_possible_positions(obj["new_object_id"], scene_graph, room_dimensions)
+    positions = get_possible_positions(obj["new_object_id"], scene_graph, room_dimensions, compiled_scene)
     print(f"Object: {obj['new_object_id']}")
     print("Possible positions: ", positions)
     abs_length, abs_width = deepcopy(obj["size_in_meters"]["length"]), deepcopy(obj["size_in_meters"]["width"])
@@ -1019,22 +1175,17 @@ def place_object(obj, scene_graph, room_dimensions, errors={}, verbose=False):
         key = ("no_positions_found", obj["new_object_id"])
         errors[key] = 1 + errors.get(key, 0)
         return errors 
-    children = [element for element in scene_graph if "placement" in element.keys() and obj.get("new_object_id") in [x["object_id"] for x in element["placement"]["objects_in_room"]]]
-    topological_sorted = get_topological_ordering(scene_graph)
+    # Already in topological order
+    children = compiled_scene.get_children(obj["new_object_id"])
 
     # Check condition to skip placing object
     if "position" in obj.keys():
-        current_collisions = 0
-        for obj_B in scene_graph:
-            if obj_B == obj or "position" not in obj_B.keys():
-                continue
-            if is_collision_3d(obj, obj_B):
-                current_collisions += 1
+        current_collisions = int(collision_engine.collides(obj))
         overlap = calculate_overlap(cluster_constraint, positions[0])
         for pos in positions[1:]:
             overlap = calculate_overlap(overlap, pos)
         check_preposition = is_collision_3d(obj, overlap, bbox_instead=True) if overlap is not None else False
-        check_children = any([is_collision_3d(child, item) for child in children if "position" in child.keys() for item in scene_graph if item["new_object_id"] != child["new_object_id"] and "position" in item.keys()])
+        check_children = any([collision_engine.collides(child) for child in children if "position" in child.keys()])
         if current_collisions == 0 and check_preposition and (not check_children or len(children) == 0):
             if verbose:
                 print("Object already placed: ", obj["new_object_id"])
@@ -1055,14 +1206,18 @@ def place_object(obj, scene_graph, room_dimensions, errors={}, verbose=False):
         errors = get_no_overlap_reason(obj, positions, cluster_constraint, errors)
         return errors
     
+    candidates = sample_candidates(obj, overlap, collision_engine, rng, sampling, batch_size)
     counter = 0
     while True:
         counter += 1
-        if counter > 50:
+        position = next(candidates, None)
+        # Stop early when the deadline (time.perf_counter() value) of the search has passed or the search was cancelled
+        stop = (deadline is not None and time.perf_counter() > deadline) or (stop_event is not None and stop_event.is_set())
+        if counter > 50 or position is None or stop:
             if verbose:
                 print("No positions found for object: ", obj["new_object_id"])
                 print(overlap)
-            del obj["position"]
+            collision_engine.unplace(obj)
             # If there wasn't any errors, it means that the object was colliding with other objects
             if not errors:
                 key = ("no_positions_found", obj["new_object_id"])
@@ -1071,36 +1226,17 @@ def place_object(obj, scene_graph, room_dimensions, errors={}, verbose=False):
                 # print("OBJECT DELETED!!")
                 # scene_graph.remove(obj)
             return errors
-        if is_point_bbox(overlap):
-            counter = 50
-        x = random.uniform(overlap[0], overlap[1])
-        y = random.uniform(overlap[2], overlap[3])
-        z = random.uniform(overlap[4], overlap[5])
-        obj["position"] = {
-            "x" : x,
-            "y" : y,
-            "z" : z
-        }
+        collision_engine.place(obj, position)
         if verbose:
             print("Assigned position: ", obj["position"], " to object: ", obj["new_object_id"])
-        flag = False
-        for obj_B in scene_graph:
-            if obj_B == obj or "position" not in obj_B.keys():
-                continue
-            if is_collision_3d(obj, obj_B):
-                flag = True
-                break
-        if flag:
+        if collision_engine.collides(obj):
             continue
         
         child_flag = False
-        # Topologically sort children
-        children = [x for topo in topological_sorted for x in children if topo == x["new_object_id"]]
-        # print("Sorted children: ", [x["new_object_id"] for x in children])
         for child in children:
             if verbose:
                 print(obj["new_object_id"], " placing child: ", child["new_object_id"])
-            errors_child = place_object(child, scene_graph, room_dimensions, errors={})
+            errors_child = place_object(child, scene_graph, room_dimensions, errors={}, collision_engine=collision_engine, sampling=sampling, batch_size=batch_size, deadline=deadline, stop_event=stop_event, rng=rng, compiled_scene=compiled_scene)
             if verbose:
                 print("Errors child: ", errors_child)
             if errors_child:
@@ -1117,8 +1253,7 @@ def place_object(obj, scene_graph, room_dimensions, errors={}, verbose=False):
         if child_flag:
             # Delete the position key in children
             for child in children:
-                if "position" in child.keys():
-                    del child["position"]
+                collision_engine.unplace(child)
             continue
         if verbose:
             print("Object placed: ", obj["new_object_id"])